@@ -1,12 +1,12 @@
 import time
 import streamlit as st
 import pandas as pd
+import numpy as np
 from supabase import create_client, Client
 from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from postgrest.exceptions import APIError
 import plotly.graph_objects as go
-import plotly.express as px  # opcional, pero útil para templates
 
 
 # -----------------------------------------------------------------------------
@@ -22,11 +22,16 @@ if missing:
     st.stop()
 
 # -----------------------------------------------------------------------------
-# Supabase client (singleton cacheado)
+# Supabase client (uno por sesión de usuario)
 # -----------------------------------------------------------------------------
-@st.cache_resource
 def get_supabase() -> Client:
-    return create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_ANON_KEY"])
+    # Por sesión: el header Authorization de PostgREST ya no se comparte entre usuarios,
+    # así que basta adjuntar el token cuando cambia.
+    client = st.session_state.get("_supabase_client")
+    if client is None:
+        client = create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_ANON_KEY"])
+        st.session_state["_supabase_client"] = client
+    return client
 
 supabase: Client = get_supabase()
 
@@ -39,6 +44,11 @@ def get_supabase_admin() -> Client:
 
 supabase_admin: Client = get_supabase_admin()
 
+@st.cache_data(ttl=120, show_spinner=False)
+def _list_users_cached() -> dict:
+    """{correo -> id} de Auth; evita llamar a la API admin en cada rerun de Config."""
+    return {u.email: u.id for u in supabase_admin.auth.admin.list_users() if u.email}
+
 
 # -----------------------------------------------------------------------------
 # Auth state + cache buster + umbrales
@@ -54,10 +64,11 @@ if "obs_cache_buster" not in st.session_state:
     st.session_state.obs_cache_buster = 0
 
 # Umbrales semáforo (Clientes/Total)
-if "sem_red_max" not in st.session_state:
-    st.session_state.sem_red_max = 0.10  # 10%
-if "sem_yellow_max" not in st.session_state:
-    st.session_state.sem_yellow_max = 0.25  # 25%
+# umbrales del semáforo en % enteros (sin ida y vuelta float <-> int en Config)
+if "sem_red_pct" not in st.session_state:
+    st.session_state.sem_red_pct = 10
+if "sem_yellow_pct" not in st.session_state:
+    st.session_state.sem_yellow_pct = 25
 
 JWT_SKEW_SECONDS = 60
 NUKE_PASSWORD = st.secrets.get("NUKE_PASSWORD", "")
@@ -88,6 +99,8 @@ def _refresh_session(force: bool = False) -> bool:
             data = supabase.auth.refresh_session()
         except TypeError:
             data = supabase.auth.refresh_session({"refresh_token": getattr(sess, "refresh_token", None)})
+        # el token cambia: invalidar el cache de JWT
+        st.session_state.pop("_jwt_cache", None)
         if data and getattr(data, "session", None):
             st.session_state.session = data.session
             st.session_state.user = data.user or st.session_state.get("user")
@@ -120,11 +133,26 @@ def _ensure_valid_session() -> bool:
     return True
 
 def _attach_postgrest_token_if_any():
+    # Cache {access_token: exp} en sesión: si el token ya está adjunto y no ha
+    # expirado, evitamos validar/adjuntar de nuevo en cada rerun.
+    sess = st.session_state.get("session")
+    token = getattr(sess, "access_token", None) if sess else None
+    if token:
+        jwt_cache = st.session_state.setdefault("_jwt_cache", {})
+        exp = jwt_cache.get(token)
+        if (exp is not None and exp > int(time.time()) + JWT_SKEW_SECONDS
+                and st.session_state.get("_attached_token") == token):
+            return
     if not _ensure_valid_session():
         return
     sess = st.session_state.get("session")
     if sess and getattr(sess, "access_token", None):
-        supabase.postgrest.auth(sess.access_token)
+        token = sess.access_token
+        supabase.postgrest.auth(token)
+        exp = _get_expires_at(sess)
+        # un solo token vigente por sesión: se descartan los anteriores
+        st.session_state["_jwt_cache"] = {token: exp} if exp is not None else {}
+        st.session_state["_attached_token"] = token
 
 def _retry_on_jwt_expired(func, *args, **kwargs):
     try:
@@ -152,6 +180,26 @@ def _format_api_error(e: APIError) -> str:
         pass
     return str(e)
 
+# Función no encontrada (PostgREST / Postgres): la RPC no está instalada en la base
+RPC_MISSING_CODES = ("PGRST202", "42883")
+
+def _rpc_missing(e: APIError) -> bool:
+    return getattr(e, "code", None) in RPC_MISSING_CODES
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _is_admin_cached(uid: str) -> bool:
+    # Nota: las excepciones no se cachean (se propagan) para reintentar en el siguiente rerun
+    def _call():
+        return supabase.table("admins").select("user_id").eq("user_id", uid).execute()
+    res = _retry_on_jwt_expired(_call)
+    return bool(res.data)
+
+def is_admin(uid: str) -> bool:
+    try:
+        return _is_admin_cached(uid)
+    except Exception:
+        return False
+
 def login(email: str, password: str):
     try:
         res = supabase.auth.sign_in_with_password({"email": email, "password": password})
@@ -169,6 +217,11 @@ def logout():
     except:
         pass
 
+    # Solo la entrada del usuario que sale; las de otras sesiones siguen en caché
+    u = st.session_state.get("user")
+    if u is not None:
+        _is_admin_cached.clear(u.id)
+
     for key in list(st.session_state.keys()):
         del st.session_state[key]
 
@@ -179,14 +232,29 @@ _attach_postgrest_token_if_any()
 
 
 # -----------------------------------------------------------------------------
-# Login UI
+# Header (título + logo)
 # -----------------------------------------------------------------------------
-if st.session_state.user is None:
+LOGO_PATH = "assets/LOGO_FINARQ.png"
+
+@st.cache_data(show_spinner=False)
+def _logo_bytes() -> bytes:
+    # Se lee del disco una sola vez por proceso
+    with open(LOGO_PATH, "rb") as f:
+        return f.read()
+
+def render_header():
     col1, col2 = st.columns([4, 1])
     with col1:
         st.title("Funnel de Ventas")
     with col2:
-        st.image("assets/LOGO_FINARQ.png", width=300)
+        st.image(_logo_bytes(), width=300)
+
+
+# -----------------------------------------------------------------------------
+# Login UI
+# -----------------------------------------------------------------------------
+if st.session_state.user is None:
+    render_header()
 
     with st.form("login"):
         email = st.text_input("Correo", placeholder="tucorreo@empresa.com")
@@ -208,15 +276,21 @@ ALIAS = user.email.split("@")[0]
 # -----------------------------------------------------------------------------
 # Utils / Data access
 # -----------------------------------------------------------------------------
-def is_admin(uid: str) -> bool:
-    _attach_postgrest_token_if_any()
-    def _call():
-        return supabase.table("admins").select("user_id").eq("user_id", uid).execute()
-    try:
-        res = _retry_on_jwt_expired(_call)
-        return bool(res.data)
-    except Exception:
-        return False
+TEXT_DTYPE = pd.StringDtype("pyarrow")  # columnas de texto libre de capturas
+
+# Columnas de capturas que usa la app (proyección explícita en vez de select("*"))
+CAPTURAS_COLS = [
+    "id","fecha","referenciador","cliente","producto","tipo",
+    "estatus","asesor","ts","user_id",
+    "monto_estimado","monto_real",
+    "nota","prob_cierre"
+]
+
+# Proyección para el resumen por asesor / vista por asesor del visor
+RESUMEN_COLS = ("asesor", "estatus", "monto_estimado", "monto_real", "prob_cierre")
+
+CAPTURAS_LIMIT = 5000  # tope de filas por consulta a capturas
+CAPTURAS_PAGE = 1000   # filas por página en consultas sin tope (max-rows de PostgREST)
 
 def _query_capturas(
     *,
@@ -228,11 +302,15 @@ def _query_capturas(
     tipo: str | None = None,
     asesor: str | None = None,
     estatus: str | None = None,
-    limit: int = 5000,
+    limit: int | None = CAPTURAS_LIMIT,
+    columns: tuple[str, ...] | None = None,
 ):
+    # columns: proyección opcional (subconjunto de CAPTURAS_COLS) para vistas que no usan todo
+    # limit=None: sin tope, se pagina con range() hasta traer todo (exportaciones)
+    sel_cols = [c for c in CAPTURAS_COLS if c in columns] if columns else CAPTURAS_COLS
     _attach_postgrest_token_if_any()
-    def _call():
-        q = supabase.table("capturas").select("*")
+    def _base():
+        q = supabase.table("capturas").select(",".join(sel_cols))
         if scope == "mine" and not is_admin_flag:
             q = q.eq("user_id", uid)
         if date_from is not None:
@@ -245,40 +323,49 @@ def _query_capturas(
             q = q.eq("asesor", asesor)
         if estatus:
             q = q.eq("estatus", estatus)
-        q = q.order("fecha", desc=True).order("ts", desc=True).limit(limit)
-        return q.execute()
-    res = _retry_on_jwt_expired(_call)
-
-    df = pd.DataFrame(res.data or [])
+        return q.order("fecha", desc=True).order("ts", desc=True)
+    if limit is not None:
+        rows = _retry_on_jwt_expired(lambda: _base().limit(limit).execute()).data or []
+    else:
+        rows = []
+        while True:
+            start = len(rows)
+            # id desempata el orden para que las páginas no se traslapen
+            page = _retry_on_jwt_expired(
+                lambda: _base().order("id").range(start, start + CAPTURAS_PAGE - 1).execute()
+            ).data or []
+            rows.extend(page)
+            if len(page) < CAPTURAS_PAGE:
+                break
+
+    df = pd.DataFrame(rows)
     if not df.empty:
-        required_cols = [
-            "id","fecha","referenciador","cliente","producto","tipo",
-            "estatus","asesor","ts","user_id",
-            "monto_estimado","monto_real",
-            "nota","prob_cierre"
-            ]
-
-        for c in required_cols:
-            if c not in df.columns:
-                df[c] = pd.NA
-        df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce").dt.date
-        for c in ("referenciador","cliente","producto","tipo","estatus","asesor"):
-            if df[c].dtype != object:
-                df[c] = df[c].astype("string")
+        # la proyección explícita garantiza sel_cols (PostgREST rechaza columnas inexistentes)
+        # datetime64 (sin .dt.date): evita columnas object y reconversiones en gráficas
+        if "fecha" in df.columns:
+            df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
+        # texto libre -> strings Arrow: más compactos que object y st.dataframe no los reconvierte
+        for c in ("cliente", "nota"):
+            if c in df.columns:
+                df[c] = df[c].astype(TEXT_DTYPE)
+        # baja cardinalidad -> category (códigos enteros, comparaciones/groupby más baratos)
+        for c in ("referenciador","producto","tipo","asesor"):
+            if c in df.columns:
+                df[c] = df[c].astype("category")
+        if "estatus" in df.columns:
+            df["estatus"] = _estatus_categorical(df["estatus"])
         # numéricos seguros
         for numc in ("monto_estimado","monto_real","prob_cierre"):
-            if numc not in df.columns:
-                df[numc] = pd.NA
-            df[numc] = pd.to_numeric(df[numc], errors="coerce")
+            if numc in df.columns:
+                df[numc] = pd.to_numeric(df[numc], errors="coerce")
     else:
-        df = pd.DataFrame(columns=[
-            "id","fecha","referenciador","cliente","producto","tipo",
-            "estatus","asesor","ts","user_id","monto_estimado","monto_real","nota", "prob_cierre"
-        ])
+        df = _EMPTY_CAPTURAS[sel_cols].copy()
     return df
 
-@st.cache_data(ttl=20)
-def load_capturas_filtered(
+# cache_resource: sin pickle/unpickle ni hash del DataFrame en cada hit. El objeto es
+# compartido entre sesiones: no mutarlo, usar load_capturas_filtered (copia superficial).
+@st.cache_resource(ttl=20, max_entries=32, show_spinner=False)
+def _load_capturas_shared(
     cache_buster: int,
     *,
     uid: str,
@@ -289,7 +376,8 @@ def load_capturas_filtered(
     tipo: str | None = None,
     asesor: str | None = None,
     estatus: str | None = None,
-    limit: int = 5000,
+    limit: int | None = CAPTURAS_LIMIT,
+    columns: tuple[str, ...] | None = None,
 ):
     return _query_capturas(
         uid=uid,
@@ -301,13 +389,201 @@ def load_capturas_filtered(
         asesor=asesor,
         estatus=estatus,
         limit=limit,
+        columns=columns,
     )
 
+def load_capturas_filtered(cache_buster: int, **filters) -> pd.DataFrame:
+    # copia superficial: agregar/reemplazar columnas no toca el frame cacheado
+    return _load_capturas_shared(cache_buster, **filters).copy(deep=False)
+
+CAPTURAS_MEMO_TTL = 20  # mismo TTL que load_capturas_filtered
+
+def load_capturas_memo(slot: str, cache_buster: int, **kwargs):
+    """
+    Memo por sesión encima de load_capturas_filtered: si los filtros y el cache_buster
+    no cambiaron, reutiliza el DataFrame sin pasar por el hash/unpickle de st.cache_data.
+    """
+    memo_key = (cache_buster, tuple(sorted(kwargs.items())))
+    memo = st.session_state.get(f"_memo_{slot}")
+    if memo and memo["key"] == memo_key and time.time() - memo["at"] < CAPTURAS_MEMO_TTL:
+        return memo["df"]
+    df = load_capturas_filtered(cache_buster, **kwargs)
+    st.session_state[f"_memo_{slot}"] = {"key": memo_key, "at": time.time(), "df": df}
+    return df
+
+def _filtrar_capturas(df: pd.DataFrame, *, asesor=None, tipo=None, estatus=None) -> pd.DataFrame:
+    """Filtros de capturas en pandas (comparaciones sobre códigos de categoría)."""
+    mask = pd.Series(True, index=df.index)
+    if asesor == "—":
+        # placeholder del resumen para asesor vacío / nulo
+        mask &= (df["asesor"].isna() | (df["asesor"] == "")).to_numpy(dtype=bool)
+    elif asesor is not None:
+        mask &= df["asesor"] == asesor
+    if tipo is not None:
+        mask &= df["tipo"] == tipo
+    if estatus is not None:
+        mask &= df["estatus"] == estatus
+    return df if mask.all() else df[mask]
+
+def load_capturas_indiv(cache_buster: int, filtros: dict) -> pd.DataFrame:
+    """
+    Capturas de Mi tablero: un solo fetch por periodo (sin tipo/estatus) y esos filtros en
+    pandas sobre códigos de categoría; cambiarlos no vuelve a consultar Supabase.
+    Si el periodo llega a CAPTURAS_LIMIT, tipo/estatus van al servidor para no perder filas.
+    """
+    df = load_capturas_memo("indiv", cache_buster, **{**filtros, "tipo": None, "estatus": None})
+    if len(df) >= CAPTURAS_LIMIT and (filtros.get("tipo") is not None or filtros.get("estatus") is not None):
+        return load_capturas_memo("indiv_filtrado", cache_buster, **filtros)
+    return _filtrar_capturas(df, tipo=filtros.get("tipo"), estatus=filtros.get("estatus"))
+
+_SUMMARY_KEYS = ("total", "acerc", "propuestas", "docs", "clientes", "cancelados", "sum_est", "sum_real", "esperado")
+
+@st.cache_data(ttl=20)
+def load_capturas_summary(
+    cache_buster: int,
+    *,
+    uid: str,
+    is_admin_flag: bool,
+    scope: str,
+    date_from: date | None = None,
+    date_to_exclusive: date | None = None,
+    tipo: str | None = None,
+    asesor: str | None = None,
+    estatus: str | None = None,
+):
+    """
+    Conteos por estatus y sumas de ingresos calculados en Postgres (RPC capturas_summary).
+    Devuelve dict con _SUMMARY_KEYS; las excepciones se propagan (no se cachean).
+    """
+    params = {
+        "p_uid": uid,
+        "p_is_admin": is_admin_flag,
+        "p_scope": scope,
+        "p_from": date_from.isoformat() if date_from else None,
+        "p_to": date_to_exclusive.isoformat() if date_to_exclusive else None,
+        "p_tipo": tipo,
+        "p_asesor": asesor,
+        "p_estatus": estatus,
+        "p_umbral": UMBRAL_ESPERADO,
+    }
+    def _call():
+        return supabase.rpc("capturas_summary", params).execute()
+    res = _retry_on_jwt_expired(_call)
+    data = res.data
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    data = data or {}
+    return {k: float(data.get(k) or 0) for k in _SUMMARY_KEYS}
+
+def _summary_from_df(df: pd.DataFrame) -> dict:
+    """Respaldo client-side de load_capturas_summary (mismo formato)."""
+    if df is None or df.empty:
+        return {k: 0.0 for k in _SUMMARY_KEYS}
+    counts = df["estatus"].value_counts()  # una sola pasada sobre la columna
+    return {
+        "total": len(df),
+        "acerc": int(counts.get("Acercamiento", 0)),
+        "propuestas": int(counts.get("Propuesta", 0)),
+        "docs": int(counts.get("Documentación", 0)),
+        "clientes": int(counts.get("Cliente", 0)),
+        "cancelados": int(counts.get("Cancelado", 0)),
+        "sum_est": float(df["monto_estimado"].fillna(0).sum()),
+        "sum_real": float(df.loc[df["estatus"] == "Cliente", "monto_real"].fillna(0).sum()),
+        "esperado": float(df["monto_estimado"].where(df["prob_cierre"] > UMBRAL_ESPERADO).sum()),
+    }
+
+def _json_val(x):
+    # valores serializables para payloads de PostgREST
+    if x is None or (not isinstance(x, (list, dict)) and pd.isna(x)):
+        return None
+    if isinstance(x, pd.Timestamp) and x == x.normalize():
+        return x.date().isoformat()  # fecha es date en Postgres
+    if isinstance(x, (date, datetime, pd.Timestamp)):
+        return x.isoformat()
+    if hasattr(x, "item"):
+        return x.item()
+    return x
+
+IN_FILTER_CHUNK = 500  # ids por request en filtros in.(...) (límite de URL de PostgREST)
+
+def _chunks(items: list, size: int = IN_FILTER_CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def delete_capturas_by_ids(ids: list[str], *, user_id: str | None = None) -> int:
+    """Borra capturas por id con un DELETE ... in.(...) por bloque. Si user_id, restringe a sus registros."""
+    ids = [str(i) for i in ids]
+    n = 0  # filas realmente borradas (RLS / user_id pueden excluir algunas)
+    for chunk in _chunks(ids):
+        def _del():
+            q = supabase.table("capturas").delete().in_("id", chunk)
+            if user_id:
+                q = q.eq("user_id", user_id)
+            return q.execute()
+        n += len(_retry_on_jwt_expired(_del).data or [])
+    return n
+
+CAPTURAS_EDITABLE_COLS = {"estatus", "monto_real", "nota", "prob_cierre"}
+
+def update_capturas_by_ids(changes: list[tuple[str, dict]], *, user_id: str) -> int:
+    """
+    Actualiza solo las columnas modificadas de cada captura.
+    Primero intenta la RPC capturas_update_many (un solo round trip para todo el guardado);
+    si no está instalada, agrupa las filas con el mismo payload en un UPDATE ... where id in.(...)
+    por bloque (k payloads distintos -> k requests). Restringe a los registros de user_id.
+    """
+    changes = [(str(rid), upd) for rid, upd in changes if upd]
+    if not changes:
+        return 0
+    if all(set(upd) <= CAPTURAS_EDITABLE_COLS for _, upd in changes):
+        def _rpc():
+            return supabase.rpc("capturas_update_many", {"p_rows": [{"id": rid, **upd} for rid, upd in changes]}).execute()
+        try:
+            return int(_retry_on_jwt_expired(_rpc).data or 0)
+        except APIError as e:
+            if not _rpc_missing(e):
+                raise
+            # RPC no instalada: respaldo con UPDATE agrupados
+
+    grupos: dict[tuple, list[str]] = {}
+    for rid, upd in changes:
+        grupos.setdefault(tuple(sorted(upd.items())), []).append(rid)
+    n = 0
+    for key, ids in grupos.items():
+        upd = dict(key)
+        for chunk in _chunks(ids):
+            def _upd():
+                return supabase.table("capturas").update(upd).in_("id", chunk).eq("user_id", user_id).execute()
+            res = _retry_on_jwt_expired(_upd)
+            n += len(res.data or [])
+    return n
+
+INSERT_CHUNK = 1000  # filas por POST en inserts masivos
+
+def bulk_insert(table: str, rows: dict | list[dict]):
+    """INSERT de una o varias filas; siempre envía listas (un POST por bloque de INSERT_CHUNK)."""
+    rows = [rows] if isinstance(rows, dict) else list(rows)
+    _attach_postgrest_token_if_any()
+    data = []
+    for chunk in _chunks(rows, INSERT_CHUNK):
+        def _ins():
+            return supabase.table(table).insert(chunk).execute()
+        data.extend(_retry_on_jwt_expired(_ins).data or [])
+    return data
+
 # --------- Observaciones: DAO helpers ---------
-def _query_observaciones_for_user(pending_only: bool = True):
+# Proyección explícita: solo lo que muestra el panel admin. El guardado de "done" envía
+# únicamente {done, done_at, done_by_user_id}, no filas completas.
+OBS_ADMIN_COLS = "id,asesor_alias,cliente,mensaje,created_at,done"
+OBS_USER_COLS = "id,cliente,mensaje,created_at"
+OPORTUNIDADES_COLS = "id,asesor_user_id,producto,aliado,descripcion,atendida,atendida_at,created_at"
+
+# Cacheado por uid + obs_cache_buster: los reruns de Mi tablero no repiten la consulta
+@st.cache_data(ttl=30, show_spinner=False)
+def _query_observaciones_for_user(cache_buster: int, uid: str, pending_only: bool = True):
     _attach_postgrest_token_if_any()
     def _call():
-        q = supabase.table("observaciones").select("*").eq("asesor_user_id", user.id)
+        q = supabase.table("observaciones").select(OBS_USER_COLS).eq("asesor_user_id", uid)
         if pending_only:
             q = q.eq("done", False)
         q = q.order("created_at", desc=True)
@@ -315,10 +591,13 @@ def _query_observaciones_for_user(pending_only: bool = True):
     res = _retry_on_jwt_expired(_call)
     return pd.DataFrame(res.data or [])
 
-def _query_observaciones_admin(date_from=None, date_to_exclusive=None, asesor_user_id=None):
+# Caché de proceso: uid / is_admin_flag van en la llave porque el resultado depende del RLS
+@st.cache_data(ttl=120, show_spinner=False)
+def _query_observaciones_admin(cache_buster: int, date_from=None, date_to_exclusive=None, asesor_user_id=None,
+                               *, uid: str, is_admin_flag: bool):
     _attach_postgrest_token_if_any()
     def _call():
-        q = supabase.table("observaciones").select("*")
+        q = supabase.table("observaciones").select(OBS_ADMIN_COLS)
         if date_from is not None:
             q = q.gte("created_at", f"{date_from.isoformat()} 00:00:00")
         if date_to_exclusive is not None:
@@ -330,15 +609,28 @@ def _query_observaciones_admin(date_from=None, date_to_exclusive=None, asesor_us
     res = _retry_on_jwt_expired(_call)
     return pd.DataFrame(res.data or [])
 
-def _get_asesores_map(limit: int = 10000):
+@st.cache_data(ttl=120, show_spinner=False)
+def _get_asesores_map(cache_buster: int = 0, limit: int = 10000, *, uid: str, is_admin_flag: bool):
     """
     Devuelve dict {alias_asesor -> user_id} usando capturas recientes (ts desc).
     Garantiza alias únicos tomando el user_id más reciente visto.
+    Cacheado; cache_buster (capturas_cache_buster) invalida al guardar capturas.
+    uid / is_admin_flag van en la llave: el caché es de proceso y el resultado depende del RLS.
+    Usa la RPC asesores_map (DISTINCT ON en Postgres); si no está instalada, escanea capturas.
     """
-    _attach_postgrest_token_if_any()
+    def _rpc():
+        return supabase.rpc("asesores_map", {}).execute()
+    try:
+        res = _retry_on_jwt_expired(_rpc)
+        return {r["asesor"]: r["user_id"] for r in (res.data or []) if r.get("asesor") and r.get("user_id")}
+    except APIError as e:
+        if not _rpc_missing(e):
+            raise
+        # RPC no instalada: respaldo con el escaneo de capturas
+
     def _call():
         return supabase.table("capturas") \
-            .select("asesor,user_id,ts") \
+            .select("asesor,user_id") \
             .order("ts", desc=True) \
             .limit(limit) \
             .execute()
@@ -347,20 +639,35 @@ def _get_asesores_map(limit: int = 10000):
     rows = res.data or []
     for r in rows:
         alias = r.get("asesor")
-        uid = r.get("user_id")
-        if alias and uid and alias not in ases_map:
-            ases_map[alias] = uid
+        user_id = r.get("user_id")
+        if alias and user_id and alias not in ases_map:
+            ases_map[alias] = user_id
     return ases_map
 
 def _get_metas_mes(periodo: date):
     _attach_postgrest_token_if_any()
     def _call():
-        return supabase.table("metas_asesor").select("*").eq("periodo", periodo.isoformat()).execute()
+        return supabase.table("metas_asesor").select("asesor_alias,meta_mxn").eq("periodo", periodo.isoformat()).execute()
     res = _retry_on_jwt_expired(_call)
     return pd.DataFrame(res.data or [])
 
 def _get_meta_asesor_sum(uid: str, date_from: date | None, date_to_exclusive: date | None) -> float:
+    """Suma de meta_mxn vía RPC meta_asesor_sum; si no está instalada, suma las filas."""
     _attach_postgrest_token_if_any()
+    params = {
+        "p_uid": uid,
+        "p_from": date_from.isoformat() if date_from else None,
+        "p_to": date_to_exclusive.isoformat() if date_to_exclusive else None,
+    }
+    def _rpc():
+        return supabase.rpc("meta_asesor_sum", params).execute()
+    try:
+        return float(_retry_on_jwt_expired(_rpc).data or 0.0)
+    except APIError as e:
+        if not _rpc_missing(e):
+            raise
+        # RPC no instalada: respaldo sumando las filas
+
     def _call():
         q = supabase.table("metas_asesor").select("meta_mxn,periodo").eq("asesor_user_id", uid)
         if date_from is not None:
@@ -369,11 +676,33 @@ def _get_meta_asesor_sum(uid: str, date_from: date | None, date_to_exclusive: da
             q = q.lt("periodo", date_to_exclusive.isoformat())
         return q.execute()
     res = _retry_on_jwt_expired(_call)
-    df = pd.DataFrame(res.data or [])
-    if df.empty:
-        return 0.0
-    return float(pd.to_numeric(df["meta_mxn"], errors="coerce").fillna(0).sum())
+    return float(sum(float(r.get("meta_mxn") or 0) for r in (res.data or [])))
+
+
+# ✅ Lista de productos (catalogada, con respaldo si está vacío)
+PRODUCTOS_DEFAULT = ["Divisas","Inversiones","Factoraje","Arrendamiento","TPV","Crédito TPV","Créditos"]
+
+# Catálogo casi estático: compartido entre sesiones sin TTL; se refresca desde Config
+# (_load_productos_shared.clear()). Los errores no se cachean: el respaldo va afuera.
+@st.cache_resource(show_spinner=False)
+def _load_productos_shared() -> tuple[str, ...]:
+    _attach_postgrest_token_if_any()
+    res = supabase.table("productos_config").select("producto,activo").eq("activo", True).order("producto").execute()
+    return tuple(r["producto"] for r in (res.data or []) if r.get("producto"))
+
+def load_productos():
+    try:
+        prods = list(_load_productos_shared())
+        return prods or list(PRODUCTOS_DEFAULT)
+    except Exception:
+        return list(PRODUCTOS_DEFAULT)
 
+REFERENCIADORES = [
+    "Andrea", "Amanda", "Ángel", "Angie", "Ariadna", "BNI", "César", "Cornelio", "Eduardo", "Fátima",
+    "Gilberto", "Integra", "Jorge", "Karen", "Lupita", "Mafer", "Marco",
+    "Paco", "Pepe", "Ricardo", "Vania", "Ximena",
+]
+REFERENCIADOR_DEFAULT_IDX = REFERENCIADORES.index("Jorge") if "Jorge" in REFERENCIADORES else 0
 
 # Orden lógico de estatus
 # Opciones globales de estatus (UNIFICADAS)
@@ -395,6 +724,32 @@ ESTATUS_ORDER = {
     "Cancelado": 0
 }
 
+# Categórico ordenado según ESTATUS_ORDER (Cancelado < Acercamiento < ... < Cliente)
+ESTATUS_DTYPE = pd.CategoricalDtype(sorted(ESTATUS_ORDER, key=ESTATUS_ORDER.get), ordered=True)
+
+def _estatus_categorical(s: pd.Series) -> pd.Series:
+    # Estatus fuera del catálogo se conservan como categorías de menor rango (igual que fillna(0))
+    extra = sorted(set(s.dropna().astype(str)) - set(ESTATUS_ORDER))
+    if not extra:
+        return s.astype(ESTATUS_DTYPE)
+    return s.astype(pd.CategoricalDtype(extra + list(ESTATUS_DTYPE.categories), ordered=True))
+
+# Esquema tipado de capturas (mismos dtypes que produce _query_capturas con datos)
+_CAPTURAS_SCHEMA = {c: "object" for c in CAPTURAS_COLS} | {
+    "fecha": "datetime64[ns]",
+    "cliente": TEXT_DTYPE,
+    "nota": TEXT_DTYPE,
+    "referenciador": "category",
+    "producto": "category",
+    "tipo": "category",
+    "asesor": "category",
+    "estatus": ESTATUS_DTYPE,
+    "monto_estimado": "float64",
+    "monto_real": "float64",
+    "prob_cierre": "float64",
+}
+_EMPTY_CAPTURAS = pd.DataFrame({c: pd.Series(dtype=t) for c, t in _CAPTURAS_SCHEMA.items()})
+
 def _quarter_bounds(d: date):
     q = (d.month - 1) // 3  # 0..3
     start_month = q * 3 + 1
@@ -405,13 +760,19 @@ def _quarter_bounds(d: date):
 
 
 # ---------------------- MÉTRICA Y SEMÁFOROS ----------------------
-def get_thresholds():
-    red = st.session_state.get("sem_red_max", 0.10)
-    yellow = st.session_state.get("sem_yellow_max", 0.25)
-    red = max(0.0, min(red, 0.9))
-    yellow = max(red, min(yellow, 0.95))
+SEMAFORO_LIGHTS = np.array(["🔴", "🟡", "🟢"])
+
+def get_thresholds_pct():
+    red = int(st.session_state.get("sem_red_pct", 10))
+    yellow = int(st.session_state.get("sem_yellow_pct", 25))
+    red = max(0, min(red, 90))
+    yellow = max(red, min(yellow, 95))
     return red, yellow
 
+def get_thresholds():
+    red, yellow = get_thresholds_pct()
+    return red / 100.0, yellow / 100.0
+
 def conversion_closed_over_total(total_reg: int, clientes: int):
     if total_reg <= 0:
         return 0.0, "—"
@@ -426,18 +787,313 @@ def conversion_closed_over_total(total_reg: int, clientes: int):
         light = "🟢"
     return pct, light
 
+def conversion_closed_over_total_vec(total_reg, clientes):
+    """Versión vectorizada de conversion_closed_over_total: arrays (pct, semáforo)."""
+    total = np.asarray(total_reg, dtype=float)
+    cli = np.asarray(clientes, dtype=float)
+    frac = np.divide(cli, total, out=np.zeros_like(total), where=total > 0)
+    # bins [rojo, amarillo]: searchsorted(left) -> 0 si frac <= rojo, 1 si <= amarillo, 2 si mayor
+    bins = np.array(get_thresholds())
+    light = np.where(total > 0, SEMAFORO_LIGHTS[np.searchsorted(bins, frac, side="left")], "—")
+    return frac * 100.0, light
+
+# ---------------------- SERIES PARA GRÁFICAS ----------------------
+def _daily_estimado_real(df: pd.DataFrame, date_from: date | None, date_to_exclusive: date | None) -> pd.DataFrame:
+    """
+    Serie diaria densa {estimado, real} (real solo para estatus Cliente).
+    Con periodo acotado cubre [date_from, date_to_exclusive); sin periodo, el rango de los datos.
+    Suma por día con np.add.at sobre un arreglo preasignado (sin groupby + reindex).
+    """
+    fechas = df["fecha"].to_numpy(dtype="datetime64[D]")
+    valid = ~np.isnat(fechas)
+    if date_from is not None and date_to_exclusive is not None:
+        start = np.datetime64(date_from, "D")
+        n = (date_to_exclusive - date_from).days
+    elif valid.any():
+        start = fechas[valid].min()
+        n = int((fechas[valid].max() - start).astype(int)) + 1
+    else:
+        return pd.DataFrame({"estimado": [], "real": []}, index=pd.DatetimeIndex([]))
+
+    idx = np.where(valid, (fechas - start).astype("timedelta64[D]").astype(np.int64), -1)
+    ok = valid & (idx >= 0) & (idx < n)
+    # montos ya float64 desde _query_capturas
+    est_vals = np.nan_to_num(df["monto_estimado"].to_numpy(dtype=float))
+    real_vals = np.nan_to_num(df["monto_real"].to_numpy(dtype=float))
+    cli = ok & (df["estatus"] == "Cliente").to_numpy(dtype=bool, na_value=False)
+
+    est = np.zeros(n)
+    real = np.zeros(n)
+    np.add.at(est, idx[ok], est_vals[ok])
+    np.add.at(real, idx[cli], real_vals[cli])
+    full_idx = pd.DatetimeIndex(start + np.arange(n).astype("timedelta64[D]"))
+    return pd.DataFrame({"estimado": est, "real": real}, index=full_idx)
+
+
+# Más días que esto en la gráfica Estimado vs Real se agrupan por semana.
+# 92 = trimestre más largo: Mes y Trimestre quedan diarios, solo Acumulado pasa a semanas
+DAILY_MAX_POINTS = 92
+
+# Columnas que determinan el pastel y la serie diaria de Mi tablero
+INDIV_MEMO_COLS = ["id", "fecha", "estatus", "monto_estimado", "monto_real"]
+
+def _df_fingerprint(df: pd.DataFrame, cols: list[str]) -> int:
+    """Hash barato del contenido de `cols` (sin pickle, a diferencia de st.cache_data)."""
+    return hash(pd.util.hash_pandas_object(df[cols], index=False).to_numpy().tobytes())
+
+def _build_estatus_pie(df: pd.DataFrame) -> go.Figure:
+    vc = df["estatus"].value_counts()
+    vc = vc[vc > 0]
+    labels = [s for s in ESTATUS_OPTIONS if s in vc.index]
+    values = [int(vc.get(s, 0)) for s in labels]
+
+    fig = go.Figure(data=[
+        go.Pie(
+            labels=labels,
+            values=values,
+            hole=0.35,
+            textinfo="label+percent",
+            hovertemplate="<b>%{label}</b><br>Registros: %{value}<br>%{percent}<extra></extra>",
+        )
+    ])
+    fig.update_layout(
+        template="plotly_white",
+        height=380,
+        margin=dict(l=10, r=10, t=40, b=10),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="left", x=0),
+    )
+    return fig
+
+# Memoizado por los arreglos graficados: un rerun por otro widget no reconstruye la figura
+@st.cache_data(ttl=30, show_spinner=False, max_entries=20)
+def _build_estimado_real_fig(x: np.ndarray, y_est: np.ndarray, y_real: np.ndarray, semanal: bool = False) -> go.Figure:
+    fig = go.Figure()
+    # Barras semanales: el hover aclara que el monto es de la semana, no de un día
+    x_lbl = "Semana del %{x|%d-%b}" if semanal else "%{x|%d-%b}"
+
+    fig.add_trace(go.Bar(
+        x=x, y=y_est,
+        name="Estimado",
+        hovertemplate=f"<b>{x_lbl}</b><br>Estimado: $%{{y:,.2f}}<extra></extra>"
+    ))
+
+    fig.add_trace(go.Bar(
+        x=x, y=y_real,
+        name="Real",
+        hovertemplate=f"<b>{x_lbl}</b><br>Real: $%{{y:,.2f}}<extra></extra>"
+    ))
+
+    # Estética general
+    fig.update_layout(
+        template="plotly_white",
+        title="Ingresos estimados vs reales",
+        xaxis_title="Fecha",
+        yaxis_title="MXN",
+        barmode="group",
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="left", x=0),
+        hovermode="x unified",
+        margin=dict(l=10, r=10, t=60, b=10),
+        height=420,
+    )
+
+    # Rango del eje X según el periodo seleccionado (mes o histórico)
+    fig.update_xaxes(
+        range=[pd.Timestamp(x.min()), pd.Timestamp(x.max())],
+        tickformat="%d-%b",
+        rangeslider=dict(visible=False),  # diarias hasta un trimestre, semanales después: el zoom nativo basta
+    )
+
+    # Eje Y con formato y pequeña separación superior
+    fig.update_yaxes(tickprefix="$", separatethousands=True)
+    return fig
+
+# Pie por asesor del visor; llaves en tuplas para que st.cache_data las hashee barato
+@st.cache_data(ttl=120, show_spinner=False, max_entries=200)
+def _build_asesor_pie(labels: tuple, values: tuple) -> go.Figure:
+    fig = go.Figure(data=[go.Pie(labels=list(labels), values=list(values), hole=0.35)])
+    fig.update_layout(template="plotly_white", height=320, margin=dict(l=10,r=10,t=30,b=10))
+    return fig
+
+UMBRAL_ESPERADO = 51.0  # prob_cierre (%) a partir de la cual se cuenta el ingreso esperado
+
+# Agregados por asesor (mismo formato que devuelve el RPC resumen_por_asesor)
+RESUMEN_AGG_COLS = [
+    "asesor", "total", "acerc", "propuestas", "docs", "clientes", "cancelados", "otros",
+    "sum_est", "sum_real", "esperado", "avg_prob", "otros_detalle",
+]
+
+def _asesor_keys(s: pd.Series) -> pd.Series:
+    """Alias como string; nulos y vacíos -> "—" en una sola pasada (mask)."""
+    s = s.astype("string")
+    return s.mask(s.isna() | s.eq(""), "—")
+
+def _typed_agg(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.reindex(columns=RESUMEN_AGG_COLS)
+    df["asesor"] = _asesor_keys(df["asesor"])
+    for c in ("total", "acerc", "propuestas", "docs", "clientes", "cancelados", "otros"):
+        df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0).astype(int)
+    for c in ("sum_est", "sum_real", "esperado"):
+        df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0.0).astype(float)
+    df["avg_prob"] = pd.to_numeric(df["avg_prob"], errors="coerce")
+    # {estatus fuera del catálogo -> conteo}; {} si no hay (o la RPC es anterior a la columna)
+    df["otros_detalle"] = [d if isinstance(d, dict) else {} for d in df["otros_detalle"]]
+    return df.sort_values("asesor").reset_index(drop=True)
+
+@st.cache_data(ttl=20, show_spinner=False)
+def load_resumen_asesores(
+    cache_buster: int,
+    *,
+    uid: str,
+    is_admin_flag: bool,
+    date_from: date | None = None,
+    date_to_exclusive: date | None = None,
+    tipo: str | None = None,
+) -> pd.DataFrame:
+    """
+    Agregados por asesor calculados en Postgres (RPC resumen_por_asesor): una fila por asesor
+    en vez de traer todas las capturas del periodo. Las excepciones se propagan (no se cachean).
+    uid / is_admin_flag solo forman parte de la llave del caché: la RPC es security invoker
+    y su resultado depende del RLS de quien llama.
+    """
+    params = {
+        "p_from": date_from.isoformat() if date_from else None,
+        "p_to": date_to_exclusive.isoformat() if date_to_exclusive else None,
+        "p_tipo": tipo,
+        "p_umbral": UMBRAL_ESPERADO,
+    }
+    def _call():
+        return supabase.rpc("resumen_por_asesor", params).execute()
+    res = _retry_on_jwt_expired(_call)
+    return _typed_agg(pd.DataFrame(res.data or [], columns=RESUMEN_AGG_COLS))
+
+def agg_por_asesor(df: pd.DataFrame) -> pd.DataFrame:
+    """Respaldo client-side de load_resumen_asesores (mismo formato) con una sola pasada de groupby."""
+    if df is None or df.empty:
+        return _typed_agg(pd.DataFrame(columns=RESUMEN_AGG_COLS))
+    keys = _asesor_keys(df["asesor"])
+    estatus = df["estatus"].astype("object")
+    monto_est = df["monto_estimado"]  # numéricos ya coercionados en _query_capturas
+    prob = df["prob_cierre"]
+
+    # Conteos (asesor x estatus) sobre códigos enteros: un solo np.bincount para todos los estatus
+    est_known = ["Acercamiento", "Propuesta", "Documentación", "Cliente", "Cancelado"]
+    key_codes, key_uniques = pd.factorize(keys, sort=True)
+    est_codes = pd.Categorical(estatus, categories=est_known).codes  # -1 = otro / vacío
+    ok = est_codes >= 0
+    n_e = len(est_known)
+    flat = np.bincount(key_codes[ok] * n_e + est_codes[ok], minlength=len(key_uniques) * n_e)
+    counts = pd.DataFrame(flat.reshape(-1, n_e), index=pd.Index(key_uniques), columns=est_known)
+    g = pd.DataFrame({
+        "total": keys.groupby(keys).size(),
+        "sum_est": monto_est.groupby(keys).sum(),
+        "sum_real": df["monto_real"].where(estatus == "Cliente").groupby(keys).sum(),
+        "esperado": monto_est.where(prob > UMBRAL_ESPERADO).groupby(keys).sum(),
+        "avg_prob": prob.groupby(keys).mean(),
+    }).join(counts.rename(columns={
+        "Acercamiento": "acerc", "Propuesta": "propuestas", "Documentación": "docs",
+        "Cliente": "clientes", "Cancelado": "cancelados",
+    }))
+    known = ["acerc", "propuestas", "docs", "clientes", "cancelados"]
+    g[known] = g[known].fillna(0)
+    g["otros"] = g["total"] - g[known].sum(axis=1)
+    # Estatus fuera del catálogo con su propio nombre (vacío/nulo -> "—"), como la RPC
+    if (~ok).any():
+        est_otro = _asesor_keys(estatus[~ok])
+        otros_n = est_otro.groupby([keys[~ok], est_otro]).size()
+        g["otros_detalle"] = pd.Series({
+            k: grp.droplevel(0).to_dict() for k, grp in otros_n.groupby(level=0)
+        })
+    return _typed_agg(g.rename_axis("asesor").reset_index())
+
+SIN_ASESOR = "Sin asesor"  # etiqueta visible del placeholder "—" (capturas sin asesor)
+
+def _asesor_label(alias: str) -> str:
+    return SIN_ASESOR if alias == "—" else alias
+
+def resumen_por_asesor(agg: pd.DataFrame, meta_map: dict) -> pd.DataFrame:
+    """
+    Tabla "Resumen por asesor" (conteos, montos, conversión, semáforo, meta y brecha)
+    a partir de los agregados por asesor, vectorizada por columnas.
+    """
+    pct, light = conversion_closed_over_total_vec(agg["total"], agg["clientes"])
+    meta = agg["asesor"].astype(str).map(meta_map).fillna(0.0).astype(float)
+
+    return pd.DataFrame({
+        "asesor": agg["asesor"].astype(str).replace("—", SIN_ASESOR),
+        "Total": agg["total"],
+        "Acercamientos": agg["acerc"],
+        "Propuestas": agg["propuestas"],
+        "Documentación": agg["docs"],
+        "Clientes": agg["clientes"],
+        "Estimado (MXN)": agg["sum_est"].round(2),
+        "Real (MXN)": agg["sum_real"].round(2),
+        "Tasa de conversión (Clientes/Total) %": np.round(pct, 2),
+        "Semáforo": light,
+        "Meta (MXN)": meta.round(2),
+        "Esperado >51% (MXN)": agg["esperado"].round(2),
+        "Brecha (MXN)": (meta - agg["esperado"]).round(2),
+        "Prob. cierre promedio (%)": agg["avg_prob"].round(1),
+    }).sort_values("asesor")
+
 # ---- Vista pública para tablas simples ----
+HISTORIAL_LIMIT = 200  # filas máximas renderizadas en tablas de historial
+DETALLE_PAGE_SIZE = 200  # filas por página en el detalle del Visor
+
 DISPLAY_COLS = [
     "asesor","cliente","producto","tipo","estatus","fecha","referenciador","prob_cierre",
     "monto_estimado","monto_real","nota"
 ]
 
 
+# Sin caché propio: hashear el df costaría lo mismo que ordenarlo; el detalle del
+# visor ya se memoiza por filtros en detalle_public_view
 def df_public_view(df: pd.DataFrame) -> pd.DataFrame:
     if df is None or df.empty:
         return df
     cols = [c for c in DISPLAY_COLS if c in df.columns]
-    return df[cols].sort_values(["fecha", "cliente"], ascending=[False, True])
+    out = df[cols]
+    out = out.sort_values(["fecha", "cliente"], ascending=[False, True], kind="stable")
+    if "fecha" in out.columns and pd.api.types.is_datetime64_any_dtype(out["fecha"]):
+        out["fecha"] = out["fecha"].dt.date  # solo para mostrar (sin hora)
+    return out
+
+# Vista del detalle del Visor keyed por los filtros (no por el contenido): el hit no
+# hashea el DataFrame del periodo completo en cada rerun
+@st.cache_data(ttl=20, show_spinner=False, max_entries=20)
+def detalle_public_view(cache_buster: int, *, uid, is_admin_flag, date_from, date_to_exclusive,
+                        asesor=None, tipo=None) -> tuple[pd.DataFrame, bool]:
+    """Vista del detalle y si la consulta quedó en el tope (puede faltar algún registro)."""
+    periodo = dict(uid=uid, is_admin_flag=is_admin_flag, scope="all",
+                   date_from=date_from, date_to_exclusive=date_to_exclusive)
+    df = load_capturas_filtered(cache_buster, **periodo)
+    if len(df) >= CAPTURAS_LIMIT and (asesor is not None or tipo is not None):
+        # el periodo completo no cabe en el tope: asesor/tipo van al servidor
+        # ("—" no tiene filtro eq; ese se sigue aplicando en cliente)
+        df = load_capturas_filtered(
+            cache_buster, **periodo, tipo=tipo,
+            asesor=None if asesor == "—" else asesor,
+        )
+    truncado = len(df) >= CAPTURAS_LIMIT
+    return df_public_view(_filtrar_capturas(df, asesor=asesor, tipo=tipo)), truncado
+
+# CSV del detalle completo, memoizado con las mismas llaves que detalle_public_view.
+# Consulta sin tope con asesor/tipo en el servidor: no se corta en CAPTURAS_LIMIT.
+@st.cache_data(ttl=20, show_spinner=False, max_entries=5)
+def detalle_csv(cache_buster: int, *, uid, is_admin_flag, date_from, date_to_exclusive,
+                asesor=None, tipo=None) -> bytes:
+    df = load_capturas_filtered(
+        cache_buster, uid=uid, is_admin_flag=is_admin_flag, scope="all",
+        date_from=date_from, date_to_exclusive=date_to_exclusive,
+        tipo=tipo, asesor=None if asesor == "—" else asesor, limit=None,
+    )
+    df = df_public_view(_filtrar_capturas(df, asesor=asesor, tipo=tipo))
+    return df.to_csv(index=False).encode("utf-8")
+
+def editor_checked_index(editor_key: str, col: str, index: pd.Index) -> list:
+    """Índices de `index` con `col` marcada en el data_editor `editor_key`.
+    Lee el delta disperso edited_rows (solo filas tocadas) en lugar de recorrer todo el df."""
+    edits = (st.session_state.get(editor_key) or {}).get("edited_rows", {})
+    return [index[int(i)] for i, chg in edits.items() if chg.get(col) and int(i) < len(index)]
 
 ESTATUS_COLORS = {
     "Cliente":        "#636EFA",  # azul Plotly
@@ -449,35 +1105,291 @@ ESTATUS_COLORS = {
 
 
 #colores en las filas según estatus
+# mismo color que la gráfica + transparencia + texto oscuro
+ESTATUS_ROW_CSS = {est: f"background-color: {bg}20; color: #111111;" for est, bg in ESTATUS_COLORS.items()}
+
 def style_rows_by_estatus(df: pd.DataFrame):
     if df is None or df.empty or "estatus" not in df.columns:
         return df
 
+    # CSS por fila con un solo map sobre estatus, repetido en todas las columnas
+    # (un apply(axis=None) en vez de una llamada Python por fila)
+    row_css = df["estatus"].astype("object").map(ESTATUS_ROW_CSS).fillna("").to_numpy(dtype=object)
+    css = pd.DataFrame(
+        np.repeat(row_css[:, None], df.shape[1], axis=1),
+        index=df.index, columns=df.columns,
+    )
+    return df.style.apply(lambda _: css, axis=None)
+
+# Ícono del color de cada estatus (tablas grandes sin Styler)
+ESTATUS_ICONS = {
+    "Cliente":        "🔵 Cliente",
+    "Documentación":  "🔴 Documentación",
+    "Acercamiento":   "🟢 Acercamiento",
+    "Propuesta":      "🟣 Propuesta",
+    "Cancelado":      "🟠 Cancelado",
+}
+
+def estatus_con_icono(df: pd.DataFrame) -> pd.DataFrame:
+    """Copia superficial con el ícono de color antepuesto al estatus (map sobre las categorías)."""
+    if df is None or df.empty or "estatus" not in df.columns:
+        return df
+    out = df.copy(deep=False)
+    out["estatus"] = df["estatus"].map(lambda e: ESTATUS_ICONS.get(e, e))
+    return out
+
+# -----------------------------------------------------------------------------
+# Fragmentos (secciones que se reejecutan solas)
+# -----------------------------------------------------------------------------
+# Fragmento: editar celdas solo reejecuta esta sección (sin recargar métricas ni gráficas);
+# al guardar, st.rerun() reejecuta toda la app con el buster nuevo.
+# Recibe filtros, no datos: en un rerun del fragmento se relee con el buster vigente.
+@st.fragment
+def _editor_mis_registros(filtros: dict):
+    df_f = load_capturas_indiv(st.session_state.capturas_cache_buster, filtros)
+    st.markdown("#### Editar estatus de mis registros")
+    if df_f.empty:
+        st.write("—")
+    else:
+        cols_view = ["cliente","producto","tipo","estatus","fecha","referenciador",
+                     "monto_estimado","monto_real","nota", "prob_cierre"]
+
+        # Usar ID como índice (oculto); filas sin id reciben una llave sintética única
+        id_txt = df_f["id"].astype(str).str.strip()
+        has_id = df_f["id"].notna() & ~id_txt.isin(["", "None", "nan", "<NA>"])
+        id_idx = pd.Index(np.where(has_id, id_txt, "row_" + df_f.index.astype(str)), name="id_str")
+
+        # Una sola copia (reindex) para el editor; df_f queda como snapshot "antes"
+        df_view = df_f.reindex(columns=cols_view)
+        df_view.index = id_idx
+        df_view["Eliminar"] = False
+
+        edited = st.data_editor(
+            df_view,
+            key="editor_mis_registros",
+            width="stretch",
+            column_config={
+                "estatus": st.column_config.SelectboxColumn(
+                    "Estatus",
+                    options=ESTATUS_OPTIONS,
+                    required=True,
+                ),
+                "cliente": st.column_config.TextColumn("Cliente", disabled=True),
+                "producto": st.column_config.TextColumn("Producto", disabled=True),
+                "tipo": st.column_config.TextColumn("Tipo", disabled=True),
+                "fecha": st.column_config.DateColumn("Fecha", disabled=True),
+                "referenciador": st.column_config.TextColumn("Referenciador", disabled=True),
+                "monto_estimado": st.column_config.NumberColumn("Estimado (MXN)", disabled=True, format="%.2f"),
+                "monto_real": st.column_config.NumberColumn("Real (MXN)", step=100.0, format="%.2f"),
+                "nota": st.column_config.TextColumn("Notas", help="Notas internas del asesor", width="large"),
+                "prob_cierre": st.column_config.NumberColumn("Prob. cierre (%)", min_value=0.0, max_value=100.0, step=1.0, format="%.0f"),
+                "Eliminar": st.column_config.CheckboxColumn("Eliminar"),
+
+            },
+            disabled=["cliente","producto","tipo","fecha","referenciador"], 
+            hide_index=True,
+        )
+
+        if st.button("Guardar cambios de estatus", type="primary", width="stretch"):
+            # Sin ediciones en el delta del editor: nada que comparar ni enviar
+            if not (st.session_state.get("editor_mis_registros") or {}).get("edited_rows"):
+                st.info("No hay cambios por guardar.")
+            else:
+                try:
+                    def _norm_cols(df):
+                        # Normaliza columnas editables para compararlas en bloque
+                        out = pd.DataFrame(index=df.index)
+                        out["estatus"] = df["estatus"].astype("object")
+                        out["monto_real"] = pd.to_numeric(df["monto_real"], errors="coerce")
+                        out["nota"] = df["nota"].astype("string").str.strip().replace("", pd.NA)
+                        out["prob_cierre"] = pd.to_numeric(df["prob_cierre"], errors="coerce")
+                        return out
+
+                    invalid_rows = [] # [(id, reason)]
+
+                    # Borrados
+                    del_keys = editor_checked_index("editor_mis_registros", "Eliminar", df_view.index)
+                    del_mask = pd.Series(edited.index.isin(del_keys), index=edited.index)
+                    to_delete = [str(rid) for rid in del_keys if not str(rid).startswith("row_")]
+
+                    # Diff vectorizado original vs editado (alineados por id_str)
+                    old_n = _norm_cols(df_view)
+                    new_n = _norm_cols(edited).reindex(old_n.index)
+                    same = old_n.eq(new_n) | (old_n.isna() & new_n.isna())
+                    diff = ~same.fillna(False).astype(bool)
+                    diff = diff[diff.any(axis=1) & ~del_mask.reindex(diff.index, fill_value=False)]
+
+                    # Validación en bloque: Cliente requiere monto_real > 0, solo donde cambió
+                    # el estatus o el monto real (editar una nota no revalida registros viejos)
+                    chg_n = new_n.loc[diff.index]
+                    bad = (chg_n["estatus"] == "Cliente") & ~(chg_n["monto_real"] > 0)
+                    bad &= diff["estatus"] | diff["monto_real"]
+                    invalid_rows = [(rid, "Estatus Cliente requiere Real (MXN) mayor a 0") for rid in chg_n.index[bad]]
+
+                    new_vals = new_n.loc[diff.index].copy()
+                    new_vals["prob_cierre"] = new_vals["prob_cierre"].clip(0.0, 100.0)
+                    new_vals = new_vals.astype("object").where(new_vals.notna(), None)
+
+                    # [(id, dict_update)] solo con las columnas modificadas;
+                    # filas sin id real (llave sintética) no se pueden actualizar
+                    changes = [
+                        (rid_str, {c: _json_val(new_vals.at[rid_str, c]) for c in diff.columns if flags[c]})
+                        for rid_str, flags in diff.to_dict(orient="index").items()
+                        if not str(rid_str).startswith("row_")
+                    ]
+
+                    if invalid_rows:
+                        st.error("No se guardaron cambios. Revisa:")
+                        st.dataframe(
+                            pd.DataFrame(invalid_rows, columns=["ID", "Motivo"]),
+                            hide_index=True, width="stretch",
+                        )
+                    elif not changes and not to_delete:
+                        st.info("No hay cambios por guardar.")
+                    else:
+                        # Seguridad: solo borrar registros del usuario actual
+                        n_del = delete_capturas_by_ids(to_delete, user_id=user.id) if to_delete else 0
+
+                        # UPDATE solo de columnas editadas: no pisa cambios hechos en otra sesión
+                        n_upd = update_capturas_by_ids(changes, user_id=user.id) if changes else 0
+                        st.success(f"Actualizados {n_upd} registro(s). Eliminados: {n_del}")
+                        st.session_state.capturas_cache_buster += 1
+                        st.rerun()
+                except APIError as e:
+                    st.error(f"No se pudieron guardar los cambios: {_format_api_error(e)}")
+                except Exception as e:
+                    st.error(f"No se pudieron guardar los cambios: {e}")
 
 
-    def _row_style(row):
-        est = row.get("estatus")
-        bg = ESTATUS_COLORS.get(est)
+# Fragmento: marcar casillas del editor solo reejecuta esta sección;
+# al guardar, st.rerun() reejecuta toda la app con el buster nuevo
+# Recibe los filtros y relee (cacheado) con el obs_cache_buster vigente en cada rerun.
+@st.fragment
+def _editor_obs_admin(obs_from, obs_to, asesor_user_id, is_admin_flag: bool):
+    df_obs_admin = _query_observaciones_admin(
+        st.session_state.obs_cache_buster, obs_from, obs_to, asesor_user_id=asesor_user_id,
+        uid=st.session_state.user.id, is_admin_flag=is_admin_flag,
+    )
+    if df_obs_admin.empty:
+        st.write("Sin observaciones para el criterio seleccionado.")
+        return
+    # Vista limpia: ocultamos ID internos
+    # Una sola asignación: subconjunto + orden + columna Eliminar (solo UI)
+    df_obs_admin_ed = (
+        df_obs_admin.reindex(columns=["id", "created_at","asesor_alias","cliente","mensaje","done"])
+        .sort_values("created_at", ascending=False)
+        .assign(Eliminar=False)
+    )
 
-        if bg:
-            # mismo color que la gráfica + transparencia + texto oscuro
-            return [f"background-color: {bg}20; color: #111111;"] * len(row)
+    st.caption("Marca/Desmarca la columna **Hecha** y guarda los cambios.")
+    edited_obs = st.data_editor(
+        df_obs_admin_ed.rename(columns={
+            "created_at": "Creada",
+            "asesor_alias": "Asesor",
+            "cliente": "Cliente",
+            "mensaje": "Observación",
+            "done": "Hecha",
+        }),
+        key="editor_obs_admin",
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "id": st.column_config.TextColumn("id", disabled=True),
+            "Creada": st.column_config.DatetimeColumn("Creada", disabled=True),
+            "Asesor": st.column_config.TextColumn("Asesor", disabled=True),
+            "Cliente": st.column_config.TextColumn("Cliente", disabled=True),
+            "Observación": st.column_config.TextColumn("Observación", disabled=True),
+            "Hecha": st.column_config.CheckboxColumn("Hecha"),
+            "Eliminar": st.column_config.CheckboxColumn("Eliminar"),
+        }
+    )
 
-        return [""] * len(row)
 
-    return df.style.apply(_row_style, axis=1)
+    # Para detectar cambios, reconstruimos el id usando merge con df original por columnas visibles
+    if st.button("Guardar cambios de observaciones", type="primary"):
+        try:
+            # edited_obs ya trae id, Hecha, Eliminar
+            df_e = edited_obs.copy()
+            # Normaliza nombres (porque renombraste columnas)
+            # Si id no se renombró, queda como "id"
+            # Hecha queda como "Hecha", Eliminar como "Eliminar"
+
+            # 1) Borrados
+            to_delete = df_e.loc[df_e["Eliminar"] == True, "id"].astype(str).tolist()
+            for chunk in _chunks(to_delete):
+                def _del():
+                    return supabase.table("observaciones").delete().in_("id", chunk).execute()
+                _retry_on_jwt_expired(_del)
+
+            # 2) Cambios de Hecha
+            # Cargamos base original para comparar
+            # Alineado por índice hash de id (sin merge)
+            old_done = df_obs_admin.set_index(df_obs_admin["id"].astype(str))["done"].fillna(False).astype(bool)
+            new_done = (
+                df_e.set_index(df_e["id"].astype(str))["Hecha"]
+                .reindex(old_done.index).fillna(False).astype(bool)
+            )
+            changed = old_done.ne(new_done) & ~old_done.index.isin(to_delete)
+            updates = list(new_done[changed].items())
+
+            # Dos UPDATE agrupados por estado destino (solo columnas de "done"):
+            # no reescribe mensaje/cliente/created_at ni requiere permiso de INSERT
+            to_mark_done = [oid for oid, hecha in updates if hecha]
+            to_unmark = [oid for oid, hecha in updates if not hecha]
+            done_at = datetime.utcnow().isoformat() + "Z"
+            for ids, done_payload in (
+                (to_mark_done, {"done": True, "done_at": done_at, "done_by_user_id": user.id}),
+                (to_unmark, {"done": False, "done_at": None, "done_by_user_id": None}),
+            ):
+                for chunk in _chunks(ids):
+                    def _upd():
+                        return supabase.table("observaciones").update(done_payload).in_("id", chunk).execute()
+                    _retry_on_jwt_expired(_upd)
+
+            st.success(f"Listo ✅ Eliminadas: {len(to_delete)} | Actualizadas: {len(updates)}")
+            st.session_state.obs_cache_buster += 1
+            st.rerun()
 
+        except APIError as e:
+            st.error(f"No se pudieron actualizar observaciones: {_format_api_error(e)}")
+        except Exception as e:
+            st.error(f"No se pudieron actualizar observaciones: {e}")
+
+
+# Fragmento: "Mostrar acumulado" reejecuta solo la gráfica, no toda la página
+# (sin volver a pasar por capturas, observaciones ni el editor). daily: serie por día
+# (o por semana si semanal) ya calculada en el memo de Mi tablero.
+@st.fragment
+def _grafica_estimado_real(daily: pd.DataFrame, semanal: bool):
+    acumular = st.checkbox("Mostrar acumulado", value=True, help="Activa para ver líneas acumuladas del mes.")
+    y_est = daily["estimado"].to_numpy()
+    y_real = daily["real"].to_numpy()
+    if acumular:
+        y_est = y_est.cumsum()
+        y_real = y_real.cumsum()
+
+    fig = _build_estimado_real_fig(daily.index.to_numpy(), y_est, y_real, semanal=semanal)
+    st.plotly_chart(fig, width="stretch")
+
+
+# Fragmento: mover los sliders no reejecuta el resto de la página
+@st.fragment
+def _umbrales_semaforo():
+    cur_red, cur_yellow = get_thresholds_pct()
+    red_pct = st.slider("Límite ROJO (≤)", min_value=0, max_value=50, value=min(cur_red, 50), step=1, help="Porcentaje hasta el cual se muestra 🔴")
+    yellow_pct = st.slider("Límite AMARILLO (≤)", min_value=red_pct, max_value=80, value=min(max(cur_yellow, red_pct), 80), step=1, help="Porcentaje hasta el cual se muestra 🟡 (por encima es 🟢)")
+
+    if st.button("Guardar umbrales", type="primary", width="content"):
+        st.session_state.sem_red_pct = red_pct
+        st.session_state.sem_yellow_pct = yellow_pct
+        st.success(f"Umbrales actualizados: 🔴 ≤ {red_pct}% | 🟡 ≤ {yellow_pct}% | 🟢 > {yellow_pct}%")
+        st.rerun()
 
-    return df.style.apply(_row_style, axis=1)
 
 # -----------------------------------------------------------------------------
 # UI (Header con logo)
 # -----------------------------------------------------------------------------
-col1, col2 = st.columns([4, 1])
-with col1:
-    st.title("Funnel de Ventas")
-with col2:
-    st.image("assets/LOGO_FINARQ.png", width=300)
+render_header()
 
 # Decidir pestañas según rol
 ADMIN_FLAG_GLOBAL = is_admin(st.session_state.user.id)
@@ -498,7 +1410,7 @@ with TAB_INDIV:
                     _attach_postgrest_token_if_any()
 
                     def _call():
-                        query = supabase.table("oportunidades_admin").select("*")
+                        query = supabase.table("oportunidades_admin").select(OPORTUNIDADES_COLS)
 
                         # Solo filtra si NO es admin
                         if not ADMIN_FLAG_GLOBAL:
@@ -578,34 +1490,15 @@ with TAB_INDIV:
 
         st.subheader("Captura de registro")
 
-        # ✅ Lista de productos (catalogada, con respaldo si está vacío)
-        @st.cache_data(ttl=60)
-        def load_productos():
-            try:
-                _attach_postgrest_token_if_any()
-                res = supabase.table("productos_config").select("producto,activo").eq("activo", True).order("producto").execute()
-                prods = [r["producto"] for r in (res.data or []) if r.get("producto")]
-                if not prods:
-                    prods = ["Divisas","Inversiones","Factoraje","Arrendamiento","TPV","Crédito TPV","Créditos"]
-                return prods
-            except Exception:
-                return ["Divisas","Inversiones","Factoraje","Arrendamiento","TPV","Crédito TPV","Créditos"]
-
         productos = load_productos()
 
-        REFERENCIADORES = [
-            "Andrea", "Amanda", "Ángel", "Angie", "Ariadna", "BNI", "César", "Cornelio", "Eduardo", "Fátima",
-            "Gilberto", "Integra", "Jorge", "Karen", "Lupita", "Mafer", "Marco",
-            "Paco", "Pepe", "Ricardo", "Vania", "Ximena",
-        ]
-
         with st.form("form_lead_simple", clear_on_submit=True):
             fecha = st.date_input("Fecha *", value=date.today(), key="fecha_form")
             cliente = st.text_input("Cliente *").strip()
             referenciador = st.selectbox(
                 "Referenciador *",
                 REFERENCIADORES,
-                index=REFERENCIADORES.index("Jorge") if "Jorge" in REFERENCIADORES else 0,
+                index=REFERENCIADOR_DEFAULT_IDX,
                 key="referenciador_form"
             )
             producto = st.selectbox("Producto *", productos)
@@ -650,12 +1543,7 @@ with TAB_INDIV:
                 }
                 # (Opcional) si quieres obligar 'monto_real' al crear en 'Cliente', añade inputs y validación aquí.
                 try:
-                    _attach_postgrest_token_if_any()
-
-                    def _call():
-                        return supabase.table("capturas").insert(payload).execute()
-                    
-                    _retry_on_jwt_expired(_call)
+                    bulk_insert("capturas", [payload])
                     
                     st.success("¡Registro guardado!")
                     st.session_state.capturas_cache_buster += 1
@@ -666,40 +1554,42 @@ with TAB_INDIV:
 
         # 🔔 Observaciones del admin (notificaciones)
         st.markdown("### 🔔 Observaciones del administrador")
-        df_obs = _query_observaciones_for_user(pending_only=True)
+        df_obs = _query_observaciones_for_user(st.session_state.obs_cache_buster, user.id, pending_only=True)
         if df_obs.empty:
             st.success("No tienes observaciones pendientes. ✅")
         else:
             with st.form("obs_form"):
                 checks = {}
-                for _, row in df_obs.iterrows():
-                    obs_id = row["id"]
-                    cliente_txt = row.get("cliente") or "—"
-                    msg = row.get("mensaje") or ""
-                    created_at = row.get("created_at")
-                    created_str = ""
-                    if created_at:
-                        try:
-                            created_str = str(pd.to_datetime(created_at).strftime("%Y-%m-%d %H:%M"))
-                        except Exception:
-                            created_str = str(created_at)
+                obs_cols = df_obs.reindex(columns=["id", "cliente", "mensaje", "created_at"])
+                created_raw = obs_cols["created_at"]
+                created_fmt = (
+                    pd.to_datetime(created_raw, errors="coerce", format="ISO8601")
+                    .dt.strftime("%Y-%m-%d %H:%M")
+                    .fillna(created_raw.fillna("").astype(str))
+                )
+                for obs_id, cliente_txt, msg, created_str in zip(
+                    obs_cols["id"],
+                    obs_cols["cliente"].where(obs_cols["cliente"].notna() & (obs_cols["cliente"] != ""), "—"),
+                    obs_cols["mensaje"].fillna(""),
+                    created_fmt,
+                ):
                     label = f"**{cliente_txt}** — {msg}  \n_(creada: {created_str})_"
                     checks[obs_id] = st.checkbox(label, key=f"obs_{obs_id}", value=False)
                 submit_done = st.form_submit_button("Marcar seleccionadas como realizadas ✅", width="stretch")
 
             if submit_done:
                 try:
-                    total = 0
-                    for obs_id, checked in checks.items():
-                        if checked:
-                            def _upd():
-                                return supabase.table("observaciones").update({
-                                    "done": True,
-                                    "done_at": datetime.utcnow().isoformat() + "Z",
-                                    "done_by_user_id": user.id
-                                }).eq("id", obs_id).execute()
-                            _retry_on_jwt_expired(_upd)
-                            total += 1
+                    selected_ids = [obs_id for obs_id, checked in checks.items() if checked]
+                    total = len(selected_ids)
+                    done_payload = {
+                        "done": True,
+                        "done_at": datetime.utcnow().isoformat() + "Z",
+                        "done_by_user_id": user.id
+                    }
+                    for chunk in _chunks(selected_ids):
+                        def _upd():
+                            return supabase.table("observaciones").update(done_payload).in_("id", chunk).execute()
+                        _retry_on_jwt_expired(_upd)
                     if total > 0:
                         st.success(f"Se marcaron {total} observación(es) como realizadas.")
                         st.session_state.obs_cache_buster += 1
@@ -754,33 +1644,48 @@ with TAB_INDIV:
             date_from = mes_inicio
             date_to_exclusive = mes_inicio + relativedelta(months=1)
 
-        df_f = load_capturas_filtered(
-            st.session_state.capturas_cache_buster,
+        filtros_indiv = dict(
             uid=st.session_state.user.id,
             is_admin_flag=False,
             scope="mine",
             date_from=date_from,
             date_to_exclusive=date_to_exclusive,
             tipo=tipo_param,
-            estatus=estatus_param   
+            estatus=estatus_param,
         )
+        df_f = load_capturas_indiv(st.session_state.capturas_cache_buster, filtros_indiv)
 
 
-        st.dataframe(style_rows_by_estatus(df_public_view(df_f)), use_container_width=True)
+        # Solo los registros más recientes van al navegador; métricas y gráficas usan df_f completo
+        # Historial por páginas: "Mostrar más" agrega HISTORIAL_LIMIT filas a lo ya visible.
+        # El cursor va ligado a los filtros: cambiar periodo/tipo/estatus vuelve a la primera página
+        hist_key = tuple(sorted(filtros_indiv.items()))
+        hist = st.session_state.get("historial_cursor")
+        if not hist or hist["key"] != hist_key:
+            hist = st.session_state["historial_cursor"] = {"key": hist_key, "n": HISTORIAL_LIMIT}
+        hist_n = hist["n"]
+        st.dataframe(style_rows_by_estatus(df_public_view(df_f.head(hist_n))), use_container_width=True)
+        if len(df_f) > hist_n:
+            st.caption(f"Mostrando los {hist_n} registros más recientes de {len(df_f)}.")
+            if st.button("Mostrar más", key="historial_mas"):
+                hist["n"] = hist_n + HISTORIAL_LIMIT
+                st.rerun()
 
 
         
 
-        # Métricas (Clientes/Total)
-        if df_f.empty:
-            total_reg = acerc = propuestas = docs = clientes = cancelados = 0
-        else:
-            total_reg  = len(df_f)
-            acerc      = int((df_f["estatus"] == "Acercamiento").sum())
-            propuestas = int((df_f["estatus"] == "Propuesta").sum())
-            docs       = int((df_f["estatus"] == "Documentación").sum())
-            clientes   = int((df_f["estatus"] == "Cliente").sum())
-            cancelados = int((df_f["estatus"] == "Cancelado").sum())
+        # Métricas (Clientes/Total) — agregadas en Postgres; respaldo con pandas si el RPC falla
+        try:
+            resumen = load_capturas_summary(st.session_state.capturas_cache_buster, **filtros_indiv)
+        except Exception:
+            resumen = _summary_from_df(df_f)
+
+        total_reg  = int(resumen["total"])
+        acerc      = int(resumen["acerc"])
+        propuestas = int(resumen["propuestas"])
+        docs       = int(resumen["docs"])
+        clientes   = int(resumen["clientes"])
+        cancelados = int(resumen["cancelados"])
 
 
         c0, c1, c2, c3, c4, c5 = st.columns(6)
@@ -794,19 +1699,10 @@ with TAB_INDIV:
         # ===================== KPI: Ingreso total esperado (prob > 51%) =====================
         st.markdown("### Ingreso total esperado")
 
-        umbral = 51.0
+        umbral = UMBRAL_ESPERADO
 
-        df_tmp = df_f.copy()
-        df_tmp["prob_cierre"] = pd.to_numeric(df_tmp["prob_cierre"], errors="coerce")
-        df_tmp["monto_estimado"] = pd.to_numeric(df_tmp["monto_estimado"], errors="coerce")
-
-        ingreso_esperado_total = (
-            df_tmp.loc[df_tmp["prob_cierre"] > umbral, "monto_estimado"]
-            .fillna(0)
-            .sum()
-            if not df_tmp.empty
-            else 0.0
-        )
+        # Viene del mismo agregado (RPC capturas_summary o su respaldo) que las tarjetas
+        ingreso_esperado_total = float(resumen["esperado"])
 
         st.metric(
             f"Ingreso total esperado (prob > {int(umbral)}%)",
@@ -824,42 +1720,36 @@ with TAB_INDIV:
                 # ===================== Gráfica de pastel: estatus =====================
         st.markdown("#### Distribución de estatus")
 
-        if df_f.empty:
+        # Pastel y serie diaria solo se reconstruyen si cambió el contenido de df_f
+        memo_key = (
+            None if df_f.empty else _df_fingerprint(df_f, INDIV_MEMO_COLS),
+            date_from, date_to_exclusive,
+        )
+        memo = st.session_state.get("indiv_memo")
+        if memo is not None and memo[0] == memo_key:
+            _, fig_pie, daily, semanal = memo
+        else:
+            fig_pie = None if df_f.empty else _build_estatus_pie(df_f)
+            daily = None if df_f.empty else _daily_estimado_real(df_f, date_from, date_to_exclusive)
+            semanal = daily is not None and len(daily) > DAILY_MAX_POINTS
+            # Periodos de más de un trimestre (acumulado): barras semanales en vez de diarias
+            # (semanas lunes-domingo etiquetadas por su inicio; la primera se recorta al
+            # inicio del periodo para que ninguna barra quede fuera de él)
+            if semanal:
+                inicio = daily.index[0]
+                daily = daily.resample("W-MON", label="left", closed="left").sum()
+                daily.index = daily.index.where(daily.index >= inicio, inicio)
+            st.session_state.indiv_memo = (memo_key, fig_pie, daily, semanal)
+
+        if fig_pie is None:
             st.info("Sin datos para graficar.")
         else:
-            # Por si acaso ESTATUS_OPTIONS no existe (fallback)
-            try:
-                _opts = ESTATUS_OPTIONS
-            except NameError:
-                _opts = ["Acercamiento","Propuesta","Documentación","Cliente","Cancelado"]
-
-            vc = df_f["estatus"].fillna("—").value_counts()
-
-            labels = [s for s in _opts if s in vc.index]
-            values = [int(vc.get(s, 0)) for s in labels]
-
-            fig_pie = go.Figure(data=[
-                go.Pie(
-                    labels=labels,
-                    values=values,
-                    hole=0.35,
-                    textinfo="label+percent",
-                    hovertemplate="<b>%{label}</b><br>Registros: %{value}<br>%{percent}<extra></extra>",
-                )
-            ])
-            fig_pie.update_layout(
-                template="plotly_white",
-                height=380,
-                margin=dict(l=10, r=10, t=40, b=10),
-                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="left", x=0),
-            )
-
             st.plotly_chart(fig_pie, use_container_width=True)
 
 
         # ===== NUEVO: métricas de montos por asesor =====
-        sum_est = float(df_f["monto_estimado"].fillna(0).sum()) if not df_f.empty else 0.0
-        sum_real = float(df_f.loc[df_f["estatus"]=="Cliente","monto_real"].fillna(0).sum()) if not df_f.empty else 0.0
+        sum_est = resumen["sum_est"]
+        sum_real = resumen["sum_real"]
 
         c5, c6 = st.columns(2)
         c5.metric("Suma ingresos estimados (MXN)", f"{sum_est:,.2f}")
@@ -869,103 +1759,10 @@ with TAB_INDIV:
         # ===== Gráfica de líneas (Plotly): Estimado vs Real por día (con opción acumulado) =====
         st.markdown("#### Estimado vs Real")
 
-        if df_f.empty:
+        if daily is None or daily.empty:
             st.info("Sin datos para graficar en el periodo seleccionado.")
         else:
-            dfg = df_f.copy()
-            dfg["fecha"] = pd.to_datetime(dfg["fecha"], errors="coerce")
-
-            # Agregación diaria
-            daily = dfg.groupby("fecha", as_index=True).agg(
-                estimado=("monto_estimado", "sum"),
-                # Real: tu regla original: contar real solo para filas con estatus Cliente
-                real=("monto_real", lambda s: dfg.loc[s.index].assign(
-                    _ok=(dfg.loc[s.index, "estatus"] == "Cliente")
-                ).pipe(lambda t: t.loc[t["_ok"], "monto_real"].fillna(0).sum()))
-            )
-
-            # El lambda anterior deja un número total por día; aseguremos tipo numérico
-            daily["estimado"] = pd.to_numeric(daily["estimado"], errors="coerce").fillna(0.0)
-            daily["real"]     = pd.to_numeric(daily["real"], errors="coerce").fillna(0.0)
-
-            
-            # Índice completo de fechas según el periodo seleccionado
-            if date_from is not None and date_to_exclusive is not None:
-                full_idx = pd.date_range(
-                    start=date_from,
-                    end=date_to_exclusive - timedelta(days=1),
-                    freq="D"
-                )
-            else:
-                # Acumulado: usar rango real de datos
-                full_idx = pd.date_range(
-                    start=dfg["fecha"].min(),
-                    end=dfg["fecha"].max(),
-                    freq="D"
-                )
-
-
-            daily = daily.reindex(full_idx, fill_value=0.0)
-            
-
-            # Toggle acumulado
-            acumular = st.checkbox("Mostrar acumulado", value=True, help="Activa para ver líneas acumuladas del mes.")
-            plot_df = daily.copy()
-            if acumular:
-                plot_df["estimado"] = plot_df["estimado"].cumsum()
-                plot_df["real"] = plot_df["real"].cumsum()
-
-            # ---------- Plotly: líneas bonitas
-            fig = go.Figure()
-
-            fig.add_trace(go.Bar(
-                x=plot_df.index, y=plot_df["estimado"],
-                name="Estimado",
-                hovertemplate="<b>%{x|%d-%b}</b><br>Estimado: $%{y:,.2f}<extra></extra>"
-            ))
-
-            fig.add_trace(go.Bar(
-                x=plot_df.index, y=plot_df["real"],
-                name="Real",
-                hovertemplate="<b>%{x|%d-%b}</b><br>Real: $%{y:,.2f}<extra></extra>"
-            ))
-
-            # Estética general
-            fig.update_layout(
-                template="plotly_white",
-                title="Ingresos estimados vs reales",
-                xaxis_title="Fecha",
-                yaxis_title="MXN",
-                barmode="group",
-                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="left", x=0),
-                hovermode="x unified",
-                margin=dict(l=10, r=10, t=60, b=10),
-                height=420,
-            )
-
-            # Eje X con rango del mes y slider/zoom cómodo
-            # Eje X con rango dinámico (mes o histórico)
-            # Rango del eje X según el periodo seleccionado
-            if date_from is not None and date_to_exclusive is not None:
-                x_start = date_from
-                x_end = date_to_exclusive - timedelta(days=1)
-            else:
-                x_start = dfg["fecha"].min().date() if not dfg.empty else mes_inicio
-                x_end = dfg["fecha"].max().date() if not dfg.empty else mes_inicio
-
-            fig.update_xaxes(
-                range=[full_idx.min(), full_idx.max()],
-                tickformat="%d-%b",
-                rangeslider=dict(visible=True)
-            )
-
-
-
-            
-            # Eje Y con formato y pequeña separación superior
-            fig.update_yaxes(tickprefix="$", separatethousands=True)
-
-            st.plotly_chart(fig, width="stretch")
+            _grafica_estimado_real(daily, semanal)
 
 
 
@@ -974,152 +1771,14 @@ with TAB_INDIV:
         if df_f.empty:
             st.write("—")
         else:
-            tmp = df_f.copy()
-            tmp["estatus_rank"] = tmp["estatus"].map(ESTATUS_ORDER).fillna(0)
-            max_status = tmp.groupby("cliente", as_index=False)["estatus_rank"].max()
-            solo_acerc = max_status[max_status["estatus_rank"] == ESTATUS_ORDER["Acercamiento"]]["cliente"].tolist()
-            st.write(", ".join(sorted(set(solo_acerc))) if solo_acerc else "—")
+            # estatus es categórico ordenado (ESTATUS_DTYPE): el max por cliente es el avance máximo
+            # (las llaves del groupby ya salen únicas y ordenadas: sin set/sorted extra)
+            max_status = df_f.groupby("cliente", observed=True)["estatus"].max()
+            solo_acerc = max_status.index[max_status == "Acercamiento"].tolist()
+            st.write(", ".join(solo_acerc) if solo_acerc else "—")
 
         # ========= Edición de estatus por los asesores (con monto_real requerido si Cliente) =========
-        st.markdown("#### Editar estatus de mis registros")
-        if df_f.empty:
-            st.write("—")
-        else:
-            cols_edit = ["id","cliente","producto","tipo","estatus","fecha","referenciador","monto_estimado","monto_real","nota","prob_cierre"]
-            for c in cols_edit:
-                if c not in df_f.columns:
-                    df_f[c] = pd.NA
-            df_edit_src = df_f[cols_edit].copy()
-
-            # Usar ID como índice (oculto)
-            df_edit_src["id_str"] = df_edit_src["id"].astype(str)
-
-            df_edit_src["Eliminar"] = False
-
-            df_view = df_edit_src.set_index("id_str")[[
-                "cliente","producto","tipo","estatus","fecha","referenciador",
-                "monto_estimado","monto_real","nota", "prob_cierre", "Eliminar"
-            ]]
-
-            edited = st.data_editor(
-                df_view,
-                key="editor_mis_registros",
-                width="stretch",
-                column_config={
-                    "estatus": st.column_config.SelectboxColumn(
-                        "Estatus",
-                        options=ESTATUS_OPTIONS,
-                        required=True,
-                    ),
-                    "cliente": st.column_config.TextColumn("Cliente", disabled=True),
-                    "producto": st.column_config.TextColumn("Producto", disabled=True),
-                    "tipo": st.column_config.TextColumn("Tipo", disabled=True),
-                    "fecha": st.column_config.DateColumn("Fecha", disabled=True),
-                    "referenciador": st.column_config.TextColumn("Referenciador", disabled=True),
-                    "monto_estimado": st.column_config.NumberColumn("Estimado (MXN)", disabled=True, format="%.2f"),
-                    "monto_real": st.column_config.NumberColumn("Real (MXN)", step=100.0, format="%.2f"),
-                    "nota": st.column_config.TextColumn("Notas", help="Notas internas del asesor", width="large"),
-                    "prob_cierre": st.column_config.NumberColumn("Prob. cierre (%)", min_value=0.0, max_value=100.0, step=1.0, format="%.0f"),
-                    "Eliminar": st.column_config.CheckboxColumn("Eliminar"),
-
-                },
-                disabled=["cliente","producto","tipo","fecha","referenciador"], 
-                hide_index=True,
-            )
-
-            if st.button("Guardar cambios de estatus", type="primary", width="stretch"):
-                try:
-                    # Mapas originales
-                    src_status = {str(r["id"]): r["estatus"] for _, r in df_edit_src.iterrows()}
-                    src_real   = {str(r["id"]): r.get("monto_real") for _, r in df_edit_src.iterrows()}
-                    src_nota = {str(r["id"]): r.get("nota") for _, r in df_edit_src.iterrows()}
-                    src_prob = {str(r["id"]): r.get("prob_cierre") for _, r in df_edit_src.iterrows()}
-
-
-
-                    def _num_norm(x):
-                        try:
-                            return None if x is None or pd.isna(x) else float(x)
-                        except Exception:
-                            return None
-
-                    def _txt_norm(x):
-                        if x is None or pd.isna(x):
-                            return None
-                        s = str(x).strip()
-                        return s if s else None
-
-                    changes = []      # [(id, dict_update)]
-                    to_delete = []
-                    invalid_rows = [] # [(id, reason)]
-
-
-                    for rid_str, row in edited.iterrows():
-                        new_status = row["estatus"]
-                        new_real_val = row.get("monto_real")
-                        old_status = src_status.get(str(rid_str))
-                        old_real   = src_real.get(str(rid_str))
-                        old_nota = src_nota.get(str(rid_str))
-                        new_nota = row.get("nota")
-                        old_prob = src_prob.get(str(rid_str))
-                        new_prob = row.get("prob_cierre")
-
-                        if bool(row.get("Eliminar", False)) is True:
-                            to_delete.append(str(rid_str))
-                            continue
-
-
-                        if _num_norm(new_prob) != _num_norm(old_prob):
-                            p = _num_norm(new_prob)
-                            if p is not None:
-                                p = max(0.0, min(100.0, p))
-                            upd["prob_cierre"] = p
-                            changed = True
-
-                        if to_delete:
-                            for rid in to_delete:
-                                def _del():
-                                    # Seguridad: solo borrar registros del usuario actual
-                                    return supabase.table("capturas").delete().eq("id", rid).eq("user_id", user.id).execute()
-                                _retry_on_jwt_expired(_del)
-
-
-                    
-
-                        # Detectar cambios
-                        upd = {}
-                        changed = False
-                        if old_status != new_status:
-                            upd["estatus"] = new_status
-                            changed = True
-                        if _num_norm(new_real_val) != _num_norm(old_real):
-                            upd["monto_real"] = _num_norm(new_real_val)
-                            changed = True
-                        if _txt_norm(new_nota) != _txt_norm(old_nota):
-                            upd["nota"] = _txt_norm(new_nota)
-                            changed = True
-
-                        if changed:
-                            changes.append((rid_str, upd))
-
-                    if invalid_rows:
-                        st.error("No se guardaron cambios. Revisa:")
-                        for rid, reason in invalid_rows:
-                            st.write(f"- ID {rid}: {reason}")
-                    elif not changes:
-                        st.info("No hay cambios por guardar.")
-                    else:
-                        for rid_str, upd in changes:
-                            def _call_upd():
-                                return supabase.table("capturas").update(upd).eq("id", rid_str).eq("user_id", user.id).execute()
-                            _retry_on_jwt_expired(_call_upd)
-                        st.success(f"Actualizados {len(changes)} registro(s).")
-                        st.session_state.capturas_cache_buster += 1
-                        st.rerun()
-                except APIError as e:
-                    st.error(f"No se pudieron guardar los cambios: {_format_api_error(e)}")
-                except Exception as e:
-                    st.error(f"No se pudieron guardar los cambios: {e}")
+        _editor_mis_registros(filtros_indiv)
 
 # -------------------- Conglomerado (admins) --------------------
 with TAB_CONG:
@@ -1129,10 +1788,15 @@ with TAB_CONG:
     else:
         
 
+        # Mapa {alias -> user_id} una sola vez para todo el visor
+        ases_map = _get_asesores_map(
+            st.session_state.capturas_cache_buster, uid=st.session_state.user.id, is_admin_flag=ADMIN_FLAG
+        )
+        asesores_sorted = sorted(ases_map.keys())
+
         st.markdown("### 🎯 Asignar meta mensual")
 
-        ases_map = _get_asesores_map()
-        asesores_select = ["(Yo)"] + sorted(list(ases_map.keys()))
+        asesores_select = ["(Yo)"] + asesores_sorted
 
         c1, c2, c3 = st.columns([1,1,1])
         with c1:
@@ -1168,15 +1832,14 @@ with TAB_CONG:
 ###### oportunidades registro ######
         st.markdown("### 🚀 Registrar oportunidad para asesor")
 
-        ases_map = _get_asesores_map()
-        asesores = sorted(list(ases_map.keys()))
+        asesores = asesores_sorted
 
         if asesores:
             asesor_sel = st.selectbox("Selecciona asesor", asesores, key="op_asesor")
 
             producto = st.selectbox(
                 "Producto relacionado",
-                ["Divisas","Inversiones","Factoraje","Arrendamiento","TPV","Crédito TPV","Créditos"]
+                PRODUCTOS_DEFAULT
             )
 
             aliado = st.text_input("Aliado")
@@ -1195,9 +1858,7 @@ with TAB_CONG:
                         "creada_por": user.id
                     }
                     try:
-                        def _ins():
-                            return supabase.table("oportunidades_admin").insert(payload).execute()
-                        _retry_on_jwt_expired(_ins)
+                        bulk_insert("oportunidades_admin", [payload])
                         st.success("Oportunidad creada correctamente 🚀")
                     except Exception as e:
                         st.error(f"No se pudo crear: {e}")
@@ -1205,8 +1866,6 @@ with TAB_CONG:
        ### historial de oportunidades####
         if ADMIN_FLAG_GLOBAL:
 
-            import pandas as pd
-
             st.markdown("## 📊 Gestión de oportunidades")
 
             def _load_all():
@@ -1215,7 +1874,7 @@ with TAB_CONG:
 
                     def _call():
                         return supabase.table("oportunidades_admin") \
-                            .select("*") \
+                            .select(OPORTUNIDADES_COLS) \
                             .order("created_at", desc=True) \
                             .execute()
 
@@ -1229,15 +1888,19 @@ with TAB_CONG:
                 except:
                     return []
 
-            data = _load_all()
+            # Carga y editor solo a petición: un expander colapsado igual ejecuta su
+            # contenido y serializa el data_editor en cada rerun
+            mostrar_oport = st.checkbox("Mostrar/editar oportunidades", value=False, key="mostrar_oport_admin")
+            data = _load_all() if mostrar_oport else None
 
-            if not data:
+            if not mostrar_oport:
+                st.caption("Activa la casilla para cargar y editar las oportunidades.")
+            elif not data:
                 st.info("No hay registros")
             else:
                 df = pd.DataFrame(data)
 
                 # 🔥 MAPEO DE ASESOR (user_id → alias)
-                ases_map = _get_asesores_map()
                 inv_ases_map = {v: k for k, v in ases_map.items()}
 
                 df["asesor"] = df["asesor_user_id"].map(inv_ases_map)
@@ -1249,7 +1912,7 @@ with TAB_CONG:
                 df["descripcion"] = df["descripcion"].fillna("-")
 
                 # 🔥 ESTADO
-                df["estado"] = df["atendida"].apply(lambda x: "Atendida" if x else "Activa")
+                df["estado"] = np.where(df["atendida"].fillna(False).astype(bool), "Atendida", "Activa")
 
                 # 🔥 FILTROS
                 col1, col2 = st.columns(2)
@@ -1302,8 +1965,9 @@ with TAB_CONG:
                 # 🔥 CHECKBOX DE BORRAR
                 df_final["Eliminar"] = False
 
-                edited_df = st.data_editor(
+                st.data_editor(
                     df_final,
+                    key="editor_oportunidades_admin",
                     use_container_width=True,
                     column_config={
                         "Eliminar": st.column_config.CheckboxColumn("Eliminar")
@@ -1312,18 +1976,18 @@ with TAB_CONG:
                 )
 
                 # 🔴 OBTENER IDS A BORRAR (USANDO ÍNDICES)
-                rows_to_delete = edited_df[edited_df["Eliminar"] == True].index
+                rows_to_delete = editor_checked_index("editor_oportunidades_admin", "Eliminar", df_final.index)
                 eliminar_ids = df_logic.loc[rows_to_delete, "id"].tolist()
 
                 # 🔴 BORRAR
                 if eliminar_ids:
                     if st.button("🗑️ Eliminar seleccionados"):
                         try:
-                            for _id in eliminar_ids:
+                            for chunk in _chunks(eliminar_ids):
                                 def _del():
                                     return supabase.table("oportunidades_admin") \
                                         .delete() \
-                                        .eq("id", _id) \
+                                        .in_("id", chunk) \
                                         .execute()
 
                                 _retry_on_jwt_expired(_del)
@@ -1337,19 +2001,23 @@ with TAB_CONG:
 
         st.subheader("Resumen por asesor")
         
-        periodo_admin = st.radio(
-            "Periodo (admin)",
-            ["Mes", "Trimestre", "Acumulado"],
-            horizontal=True,
-            key="periodo_admin"
-        )
+        # Form: los filtros se aplican juntos al enviar (sin reruns/consultas por cada cambio)
+        with st.form("filtros_resumen_admin"):
+            periodo_admin = st.radio(
+                "Periodo (admin)",
+                ["Mes", "Trimestre", "Acumulado"],
+                horizontal=True,
+                key="periodo_admin"
+            )
 
-        col1, col2 = st.columns([1,1])
-        with col1:
-            mes_cong = st.date_input("Mes a analizar", value=date.today().replace(day=1),
-                                     key="mes_analizar_cong").replace(day=1)
-        with col2:
-            tipo_cong = st.radio("Tipo de cliente", ["Todos","Nuevo","BAU"], horizontal=True, key="tipo_cong")
+            col1, col2 = st.columns([1,1])
+            with col1:
+                mes_cong = st.date_input("Mes a analizar", value=date.today().replace(day=1),
+                                         key="mes_analizar_cong").replace(day=1)
+            with col2:
+                tipo_cong = st.radio("Tipo de cliente", ["Todos","Nuevo","BAU"], horizontal=True, key="tipo_cong")
+
+            st.form_submit_button("Aplicar filtros", width="stretch")
 
         mes_cong_fin = mes_cong + relativedelta(months=1)
         tipo_cong_param = None if tipo_cong == "Todos" else tipo_cong
@@ -1363,174 +2031,154 @@ with TAB_CONG:
             date_from = mes_cong
             date_to_exclusive = mes_cong + relativedelta(months=1)
 
-        df_month = load_capturas_filtered(
-            st.session_state.capturas_cache_buster,
-            uid=st.session_state.user.id,
-            is_admin_flag=ADMIN_FLAG,
-            scope="all",
-            date_from=date_from,
-            date_to_exclusive=date_to_exclusive,
-            tipo=tipo_cong_param
-        )
-
-
+        # Agregados por asesor en Postgres; respaldo con pandas si el RPC no está disponible
+        try:
+            agg_ases = load_resumen_asesores(
+                st.session_state.capturas_cache_buster,
+                uid=st.session_state.user.id,
+                is_admin_flag=ADMIN_FLAG,
+                date_from=date_from,
+                date_to_exclusive=date_to_exclusive,
+                tipo=tipo_cong_param
+            )
+        except Exception:
+            df_month = load_capturas_filtered(
+                st.session_state.capturas_cache_buster,
+                uid=st.session_state.user.id,
+                is_admin_flag=ADMIN_FLAG,
+                scope="all",
+                date_from=date_from,
+                date_to_exclusive=date_to_exclusive,
+                tipo=tipo_cong_param,
+                columns=RESUMEN_COLS
+            )
+            agg_ases = agg_por_asesor(df_month)
 
         # ---- Resumen por asesor
         st.markdown("### Resumen por asesor")
-        if df_month.empty:
+        if agg_ases.empty:
             st.write("Sin datos para el filtro.")
         else:
-            df_month = df_month.copy()
-            if "asesor" not in df_month.columns:
-                df_month["asesor"] = pd.NA
-
-
-            resumen_rows = []
-
             df_metas = _get_metas_mes(mes_cong)
             meta_map = {}
             if not df_metas.empty:
-                for _, r in df_metas.iterrows():
-                    meta_map[str(r.get("asesor_alias"))] = float(r.get("meta_mxn") or 0.0)
-
-            for ases, chunk in df_month.groupby("asesor"):
-                total_reg = len(chunk)
-                ac = int((chunk["estatus"] == "Acercamiento").sum())
-                p  = int((chunk["estatus"] == "Propuesta").sum())
-                d  = int((chunk["estatus"] == "Documentación").sum())
-                c  = int((chunk["estatus"] == "Cliente").sum())
-                conv_pct, light = conversion_closed_over_total(total_reg, c)
-                avg_prob = float(pd.to_numeric(chunk["prob_cierre"], errors="coerce").dropna().mean()) if "prob_cierre" in chunk.columns else 0.0
-
-
-                sum_est = float(chunk["monto_estimado"].fillna(0).sum())
-                sum_real = float(chunk.loc[chunk["estatus"]=="Cliente","monto_real"].fillna(0).sum())
-
-                umbral = 51.0
-                tmp = chunk.copy()
-                tmp["prob_cierre"] = pd.to_numeric(tmp["prob_cierre"], errors="coerce")
-                tmp["monto_estimado"] = pd.to_numeric(tmp["monto_estimado"], errors="coerce")
-
-                esperado = float(tmp.loc[tmp["prob_cierre"] > umbral, "monto_estimado"].fillna(0).sum())
-                meta = float(meta_map.get(str(ases), 0.0))
-                brecha = meta - esperado
-
-                resumen_rows.append({
-                    "asesor": (ases if ases is not pd.NA and ases is not None else "—"),
-                    "Total": total_reg,
-                    "Acercamientos": ac,
-                    "Propuestas": p,
-                    "Documentación": d,
-                    "Clientes": c,
-                    "Estimado (MXN)": round(sum_est, 2),
-                    "Real (MXN)": round(sum_real, 2),
-                    "Tasa de conversión (Clientes/Total) %": round(conv_pct, 2),
-                    "Semáforo": light,
-                    "Meta (MXN)": round(meta, 2),
-                    "Esperado >51% (MXN)": round(esperado, 2),
-                    "Brecha (MXN)": round(brecha, 2),
-                    "Prob. cierre promedio (%)": round(avg_prob, 1),
+                meta_map = dict(zip(
+                    df_metas["asesor_alias"].astype(str),
+                    pd.to_numeric(df_metas["meta_mxn"], errors="coerce").fillna(0.0).astype(float),
+                ))
 
-
-                })
-            df_resumen = pd.DataFrame(resumen_rows).sort_values("asesor")
+            df_resumen = resumen_por_asesor(agg_ases, meta_map)
             st.dataframe(df_resumen, width="stretch")
 
             st.markdown("### 📌 Vista por asesor (estatus + ingreso esperado)")
 
-            if df_month.empty:
-                st.info("Sin datos para el periodo seleccionado.")
-            else:
-                umbral = 51.0
-
-                df_month = df_month.copy()
-                df_month["asesor"] = df_month["asesor"].astype("string")
-                df_month["asesor"] = df_month["asesor"].fillna("—").replace("", "—")
-
-
-                for ases, chunk in df_month.groupby("asesor"):
-                    ases_name = "—" if (ases is None or pd.isna(ases) or str(ases).strip() == "") else str(ases)
-
+            umbral = UMBRAL_ESPERADO
+            pie_cols = {
+                "Acercamiento": "acerc", "Propuesta": "propuestas", "Documentación": "docs",
+                "Cliente": "clientes", "Cancelado": "cancelados",
+            }
 
-                    # Ingreso esperado: suma monto_estimado donde prob_cierre > 51
-                    tmp = chunk.copy()
-                    tmp["prob_cierre"] = pd.to_numeric(tmp["prob_cierre"], errors="coerce")
-                    tmp["monto_estimado"] = pd.to_numeric(tmp["monto_estimado"], errors="coerce")
-                    esperado = float(tmp.loc[tmp["prob_cierre"] > umbral, "monto_estimado"].fillna(0).sum())
+            for r in agg_ases.to_dict(orient="records"):
+                ases_name = r["asesor"]
+                esperado = float(r["esperado"])
 
-                    # Pie de estatus
-                    vc = tmp["estatus"].fillna("—").value_counts()
-                    labels = vc.index.tolist()
-                    values = vc.values.tolist()
+                # Pie de estatus (desde los conteos agregados); estatus fuera del catálogo
+                # con su propio nombre (si la RPC no trae el detalle, juntos como "—")
+                pares = [(lbl, int(r[col])) for lbl, col in pie_cols.items() if r[col] > 0]
+                otros_det = r["otros_detalle"] or ({"—": r["otros"]} if r["otros"] > 0 else {})
+                pares += [(str(lbl), int(n)) for lbl, n in sorted(otros_det.items()) if n > 0]
+                labels = tuple(lbl for lbl, _ in pares)
+                values = tuple(n for _, n in pares)
 
-                    fig_pie = go.Figure(data=[go.Pie(labels=labels, values=values, hole=0.35)])
-                    fig_pie.update_layout(template="plotly_white", height=320, margin=dict(l=10,r=10,t=30,b=10))
+                fig_pie = _build_asesor_pie(labels, values)
 
-                    c1, c2 = st.columns([1, 2])
-                    with c1:
-                        st.subheader(f"Asesor: {ases_name}")
-                        st.metric(f"Ingreso esperado (prob > {int(umbral)}%)", f"${esperado:,.2f}")
-                    with c2:
-                        st.plotly_chart(fig_pie, use_container_width=True)
+                c1, c2 = st.columns([1, 2])
+                with c1:
+                    st.subheader(f"Asesor: {_asesor_label(ases_name)}")
+                    st.metric(f"Ingreso esperado (prob > {int(umbral)}%)", f"${esperado:,.2f}")
+                with c2:
+                    st.plotly_chart(fig_pie, use_container_width=True)
 
-                    st.divider()
+                st.divider()
 
 
-        red_max, yellow_max = get_thresholds()
-        st.caption(f"Semáforo: 🔴 ≤ {int(red_max*100)}%  |  🟡 ≤ {int(yellow_max*100)}%  |  🟢 > {int(yellow_max*100)}%")
+        red_pct, yellow_pct = get_thresholds_pct()
+        st.caption(f"Semáforo: 🔴 ≤ {red_pct}%  |  🟡 ≤ {yellow_pct}%  |  🟢 > {yellow_pct}%")
 
         # ---- Registros por asesor (con 'Todos')
         st.markdown("### Registros por asesor")
-        if not df_month.empty and "asesor" in df_month.columns:
-            asesores_base = sorted(df_month["asesor"].dropna().unique().tolist())
+        # Periodo sin capturas (el resumen sin filtro de tipo vino vacío): sin selectores
+        # ni fetch del detalle
+        if agg_ases.empty and tipo_cong_param is None:
+            st.write("Sin registros en el periodo.")
         else:
-            asesores_base = []
-        asesores_lista = ["Todos"] + asesores_base
-        tipos_lista = ["Todos","Nuevo","BAU"]
-
-        colf1, colf2 = st.columns([1,1])
-        with colf1:
-            ases_sel = st.selectbox("Asesor", asesores_lista, key="asesor_cong")
-        with colf2:
-            tipo_sel = st.selectbox("Tipo de cliente", tipos_lista, key="tipo_cong_det")
-
-        asesor_param = None if ases_sel == "Todos" else ases_sel
-        tipo_param_det = None if tipo_sel == "Todos" else tipo_sel
-
-        # ===== Registros por asesor (con opción TODO el histórico) =====
-        # Fechas según periodo_admin (Mes / Trimestre / Acumulado)
-        if periodo_admin == "Acumulado":
-            det_from = None
-            det_to_exclusive = None
-        elif periodo_admin == "Trimestre":
-            det_from, det_to_exclusive = _quarter_bounds(mes_cong)
-        else:  # Mes
-            det_from = mes_cong
-            det_to_exclusive = mes_cong + relativedelta(months=1)
-
-        df_det = load_capturas_filtered(
-            st.session_state.capturas_cache_buster,
-            uid=st.session_state.user.id,
-            is_admin_flag=ADMIN_FLAG,
-            scope="all",
-            date_from=det_from,
-            date_to_exclusive=det_to_exclusive,
-            asesor=asesor_param,
-            tipo=tipo_param_det
-        )
-
-
-        st.dataframe(
-            style_rows_by_estatus(df_public_view(df_det)),
-            use_container_width=True
-        )
+            asesores_base = agg_ases["asesor"].tolist()  # ya ordenados
+            asesores_lista = ["Todos"] + asesores_base
+            tipos_lista = ["Todos","Nuevo","BAU"]
+
+            with st.form("filtros_registros_admin"):
+                colf1, colf2 = st.columns([1,1])
+                with colf1:
+                    ases_sel = st.selectbox("Asesor", asesores_lista, key="asesor_cong",
+                                            format_func=_asesor_label)
+                with colf2:
+                    tipo_sel = st.selectbox("Tipo de cliente", tipos_lista, key="tipo_cong_det")
+                st.form_submit_button("Aplicar filtros", width="stretch")
+
+            asesor_param = None if ases_sel == "Todos" else ases_sel
+            tipo_param_det = None if tipo_sel == "Todos" else tipo_sel
+
+            # ===== Registros por asesor (con opción TODO el histórico) =====
+            # Mismo periodo (Mes / Trimestre / Acumulado) que el resumen
+            det_from, det_to_exclusive = date_from, date_to_exclusive
+
+            # Un solo fetch por periodo; asesor/tipo se filtran en cliente (cambiar esos
+            # selectores ya no dispara otra consulta a Supabase) salvo que el periodo
+            # llegue al tope de filas. La vista queda memoizada por filtros.
+            det_kwargs = dict(
+                uid=st.session_state.user.id,
+                is_admin_flag=ADMIN_FLAG,
+                date_from=det_from,
+                date_to_exclusive=det_to_exclusive,
+                asesor=asesor_param,
+                tipo=tipo_param_det,
+            )
+            df_det_view, det_truncado = detalle_public_view(st.session_state.capturas_cache_buster, **det_kwargs)
+            if det_truncado:
+                st.warning(f"La consulta llegó al máximo de {CAPTURAS_LIMIT:,} registros: puede faltar "
+                           "alguno en la tabla. El CSV completo los incluye todos.")
+
+
+            # Paginado: solo la página actual se serializa al navegador
+            total_det = 0 if df_det_view is None else len(df_det_view)
+            n_pages = max(1, -(-total_det // DETALLE_PAGE_SIZE))
+            if st.session_state.get("pagina_det_admin", 1) > n_pages:
+                st.session_state["pagina_det_admin"] = 1  # cambió el filtro y hay menos páginas
+            page = st.number_input("Página", min_value=1, max_value=n_pages, step=1, key="pagina_det_admin")
+            start = (int(page) - 1) * DETALLE_PAGE_SIZE
+            df_det_page = df_det_view if total_det == 0 else df_det_view.iloc[start:start + DETALLE_PAGE_SIZE]
+
+            # Sin Styler: el color del estatus va como ícono en la celda
+            st.dataframe(
+                estatus_con_icono(df_det_page),
+                use_container_width=True
+            )
+            if total_det > DETALLE_PAGE_SIZE or det_truncado:
+                st.caption(f"Registros {start + 1}–{min(start + DETALLE_PAGE_SIZE, total_det)} de {total_det}. "
+                           "Descarga el CSV para verlos todos.")
+                st.download_button(
+                    "Descargar CSV completo",
+                    data=detalle_csv(st.session_state.capturas_cache_buster, **det_kwargs),
+                    file_name="registros_por_asesor.csv",
+                    mime="text/csv",
+                    key="csv_det_admin",
+                )
 
 
 
         # ===================== 📝 Crear observación por ASESOR =====================
         st.markdown("### 📝 Crear observación para un asesor")
-        ases_map = _get_asesores_map()  # {alias -> user_id} desde capturas recientes
-        asesores_select = sorted(list(ases_map.keys()))
+        asesores_select = asesores_sorted  # {alias -> user_id} desde capturas recientes
         if not asesores_select:
             st.info("No hay asesores detectados en capturas para crear observaciones.")
         else:
@@ -1556,9 +2204,7 @@ with TAB_CONG:
                             "mensaje": obs_msg.strip(),
                             "created_by_user_id": user.id,
                         }
-                        def _ins():
-                            return supabase.table("observaciones").insert(payload).execute()
-                        _retry_on_jwt_expired(_ins)
+                        bulk_insert("observaciones", [payload])
                         st.success("Observación creada y notificada al asesor. 🔔")
                         st.session_state.obs_cache_buster += 1
                     except APIError as e:
@@ -1583,97 +2229,15 @@ with TAB_CONG:
             obs_to = None  # sin to_exclusive
 
         # Filtro por asesor (map con user_id)
-        ases_map_all = _get_asesores_map()
-        asesores_admin = ["Todos"] + sorted(list(ases_map_all.keys()))
+        asesores_admin = ["Todos"] + asesores_sorted
         ases_fil = st.selectbox("Asesor", asesores_admin, key="obs_asesor_filtro")
-        ases_user_filter = None if ases_fil == "Todos" else ases_map_all.get(ases_fil)
+        ases_user_filter = None if ases_fil == "Todos" else ases_map.get(ases_fil)
 
-        df_obs_admin = _query_observaciones_admin(obs_from, obs_to, asesor_user_id=ases_user_filter)
-
-        if df_obs_admin.empty:
-            st.write("Sin observaciones para el criterio seleccionado.")
+        mostrar_obs = st.checkbox("Mostrar/editar observaciones", value=False, key="mostrar_obs_admin")
+        if not mostrar_obs:
+            st.caption("Activa la casilla para cargar y editar las observaciones.")
         else:
-            # Vista limpia: ocultamos ID internos
-            df_obs_admin_ed = df_obs_admin.copy()
-
-            # Agregamos columna de eliminar (solo UI)
-            df_obs_admin_ed["Eliminar"] = False
-
-            df_obs_admin_ed = df_obs_admin_ed[[
-                "id", "created_at","asesor_alias","cliente","mensaje","done","Eliminar"
-            ]].sort_values("created_at", ascending=False)
-
-            st.caption("Marca/Desmarca la columna **Hecha** y guarda los cambios.")
-            edited_obs = st.data_editor(
-                df_obs_admin_ed.rename(columns={
-                    "created_at": "Creada",
-                    "asesor_alias": "Asesor",
-                    "cliente": "Cliente",
-                    "mensaje": "Observación",
-                    "done": "Hecha",
-                }),
-                key="editor_obs_admin",
-                use_container_width=True,
-                hide_index=True,
-                column_config={
-                    "id": st.column_config.TextColumn("id", disabled=True),
-                    "Creada": st.column_config.DatetimeColumn("Creada", disabled=True),
-                    "Asesor": st.column_config.TextColumn("Asesor", disabled=True),
-                    "Cliente": st.column_config.TextColumn("Cliente", disabled=True),
-                    "Observación": st.column_config.TextColumn("Observación", disabled=True),
-                    "Hecha": st.column_config.CheckboxColumn("Hecha"),
-                    "Eliminar": st.column_config.CheckboxColumn("Eliminar"),
-                }
-            )
-
-
-            # Para detectar cambios, reconstruimos el id usando merge con df original por columnas visibles
-            if st.button("Guardar cambios de observaciones", type="primary"):
-                try:
-                    # edited_obs ya trae id, Hecha, Eliminar
-                    df_e = edited_obs.copy()
-                    # Normaliza nombres (porque renombraste columnas)
-                    # Si id no se renombró, queda como "id"
-                    # Hecha queda como "Hecha", Eliminar como "Eliminar"
-
-                    # 1) Borrados
-                    to_delete = df_e.loc[df_e["Eliminar"] == True, "id"].astype(str).tolist()
-                    if to_delete:
-                        for oid in to_delete:
-                            def _del():
-                                return supabase.table("observaciones").delete().eq("id", oid).execute()
-                            _retry_on_jwt_expired(_del)
-
-                    # 2) Cambios de Hecha
-                    # Cargamos base original para comparar
-                    base = df_obs_admin[["id","done"]].copy()
-                    base["id"] = base["id"].astype(str)
-
-                    merged = base.merge(df_e[["id","Hecha"]], on="id", how="left")
-                    updates = []
-                    for _, r in merged.iterrows():
-                        old = bool(r["done"])
-                        new = bool(r["Hecha"])
-                        if new != old and str(r["id"]) not in set(to_delete):
-                            updates.append((str(r["id"]), new))
-
-                    for oid, new_done in updates:
-                        if new_done:
-                            payload = {"done": True, "done_at": datetime.utcnow().isoformat() + "Z", "done_by_user_id": user.id}
-                        else:
-                            payload = {"done": False, "done_at": None, "done_by_user_id": None}
-                        def _upd():
-                            return supabase.table("observaciones").update(payload).eq("id", oid).execute()
-                        _retry_on_jwt_expired(_upd)
-
-                    st.success(f"Listo ✅ Eliminadas: {len(to_delete)} | Actualizadas: {len(updates)}")
-                    st.session_state.obs_cache_buster += 1
-                    st.rerun()
-
-                except APIError as e:
-                    st.error(f"No se pudieron actualizar observaciones: {_format_api_error(e)}")
-                except Exception as e:
-                    st.error(f"No se pudieron actualizar observaciones: {e}")
+            _editor_obs_admin(obs_from, obs_to, ases_user_filter, ADMIN_FLAG)
 
 
         # ---- Borrado masivo (solo admins) hola hoa hola
@@ -1687,28 +2251,26 @@ with TAB_CFG:
         st.subheader("Parámetros de conversión")
         st.caption("Ajusta los umbrales de semáforo para la tasa Clientes/Total. Se guardan en esta sesión.")
 
-        cur_red, cur_yellow = get_thresholds()
-        red_pct = st.slider("Límite ROJO (≤)", min_value=0, max_value=50, value=int(cur_red*100), step=1, help="Porcentaje hasta el cual se muestra 🔴")
-        yellow_pct = st.slider("Límite AMARILLO (≤)", min_value=red_pct, max_value=80, value=int(cur_yellow*100), step=1, help="Porcentaje hasta el cual se muestra 🟡 (por encima es 🟢)")
+        _umbrales_semaforo()
 
-        if st.button("Guardar umbrales", type="primary", width="content"):
-            st.session_state.sem_red_max = red_pct / 100.0
-            st.session_state.sem_yellow_max = yellow_pct / 100.0
-            st.success(f"Umbrales actualizados: 🔴 ≤ {red_pct}% | 🟡 ≤ {yellow_pct}% | 🟢 > {yellow_pct}%")
-            st.rerun()
+        st.divider()
+        st.subheader("Catálogo de productos")
+        st.caption("El catálogo se comparte entre sesiones. Refréscalo después de editar productos_config.")
+        if st.button("Refrescar catálogo de productos", width="content"):
+            _load_productos_shared.clear()
+            st.success("Catálogo de productos recargado.")
 
         st.divider()
         st.subheader("🔐 Resetear contraseña de usuario (Admin)")
 
         # Obtener usuarios (correo + id)
         try:
-            users = supabase_admin.auth.admin.list_users()
+            user_map = _list_users_cached()
         except Exception as e:
             st.error(f"No se pudieron cargar los usuarios: {e}")
-            users = []
+            user_map = {}
 
-        if users:
-            user_map = {u.email: u.id for u in users if u.email}
+        if user_map:
             selected_email = st.selectbox("Selecciona usuario", sorted(user_map.keys()))
             new_pwd = st.text_input("Nueva contraseña", type="password")
             new_pwd2 = st.text_input("Confirmar nueva contraseña", type="password")
@@ -89,4 +89,181 @@ create policy if not exists "prod_ins_admin" on public.productos_config for inse
   with check (exists (select 1 from public.admins a where a.user_id = auth.uid()));
 create policy if not exists "prod_upd_admin" on public.productos_config for update to authenticated
   using (exists (select 1 from public.admins a where a.user_id = auth.uid()))
-  with check (exists (select 1 from public.admins a where a.user_id = auth.uid()));
\ No newline at end of file
+  with check (exists (select 1 from public.admins a where a.user_id = auth.uid()));
+-- Resumen agregado de capturas (conteos por estatus + sumas) para las tarjetas de métricas.
+-- security invoker: respeta el RLS del usuario que llama.
+-- (firma anterior sin p_umbral: se elimina para que la llamada por nombre no sea ambigua)
+drop function if exists public.capturas_summary(uuid, boolean, text, date, date, text, text, text);
+
+create or replace function public.capturas_summary(
+  p_uid      uuid,
+  p_is_admin boolean default false,
+  p_scope    text    default 'mine',
+  p_from     date    default null,
+  p_to       date    default null,
+  p_tipo     text    default null,
+  p_asesor   text    default null,
+  p_estatus  text    default null,
+  p_umbral   numeric default 51
+)
+returns json
+language sql
+stable
+security invoker
+as $$
+  select json_build_object(
+    'total',      count(*),
+    'acerc',      count(*) filter (where c.estatus = 'Acercamiento'),
+    'propuestas', count(*) filter (where c.estatus = 'Propuesta'),
+    'docs',       count(*) filter (where c.estatus = 'Documentación'),
+    'clientes',   count(*) filter (where c.estatus = 'Cliente'),
+    'cancelados', count(*) filter (where c.estatus = 'Cancelado'),
+    'sum_est',    coalesce(sum(c.monto_estimado), 0),
+    'sum_real',   coalesce(sum(c.monto_real) filter (where c.estatus = 'Cliente'), 0),
+    'esperado',   coalesce(sum(c.monto_estimado) filter (where c.prob_cierre > p_umbral), 0)
+  )
+  from public.capturas c
+  where (p_scope <> 'mine' or p_is_admin or c.user_id = p_uid)
+    and (p_from    is null or c.fecha >= p_from)
+    and (p_to      is null or c.fecha <  p_to)
+    and (p_tipo    is null or c.tipo = p_tipo)
+    and (p_asesor  is null or c.asesor = p_asesor)
+    and (p_estatus is null or c.estatus = p_estatus);
+$$;
+
+grant execute on function public.capturas_summary(uuid, boolean, text, date, date, text, text, text, numeric) to authenticated;
+
+-- Agregados por asesor para el visor admin (una fila por asesor, sin traer capturas al cliente).
+-- otros_detalle: {estatus -> conteo} de los estatus fuera del catálogo ('—' = vacío/nulo),
+-- para que la gráfica por asesor los muestre con su propio nombre.
+-- (cambia el tipo de retorno: se elimina la versión anterior)
+drop function if exists public.resumen_por_asesor(date, date, text, numeric);
+
+create or replace function public.resumen_por_asesor(
+  p_from   date    default null,
+  p_to     date    default null,
+  p_tipo   text    default null,
+  p_umbral numeric default 51
+)
+returns table (
+  asesor        text,
+  total         bigint,
+  acerc         bigint,
+  propuestas    bigint,
+  docs          bigint,
+  clientes      bigint,
+  cancelados    bigint,
+  otros         bigint,
+  sum_est       numeric,
+  sum_real      numeric,
+  esperado      numeric,
+  avg_prob      numeric,
+  otros_detalle jsonb
+)
+language sql
+stable
+security invoker
+as $$
+  with base as (
+    select coalesce(nullif(c.asesor, ''), '—') as asesor,
+           c.estatus, c.monto_estimado, c.monto_real, c.prob_cierre
+    from public.capturas c
+    where (p_from is null or c.fecha >= p_from)
+      and (p_to   is null or c.fecha <  p_to)
+      and (p_tipo is null or c.tipo = p_tipo)
+  ),
+  otros as (
+    select o.asesor, jsonb_object_agg(o.estatus, o.n) as detalle
+    from (
+      select b.asesor, coalesce(nullif(b.estatus, ''), '—') as estatus, count(*) as n
+      from base b
+      where b.estatus is null
+         or b.estatus not in ('Acercamiento','Propuesta','Documentación','Cliente','Cancelado')
+      group by 1, 2
+    ) o
+    group by o.asesor
+  )
+  select
+    b.asesor,
+    count(*),
+    count(*) filter (where b.estatus = 'Acercamiento'),
+    count(*) filter (where b.estatus = 'Propuesta'),
+    count(*) filter (where b.estatus = 'Documentación'),
+    count(*) filter (where b.estatus = 'Cliente'),
+    count(*) filter (where b.estatus = 'Cancelado'),
+    count(*) filter (where b.estatus is null
+                     or b.estatus not in ('Acercamiento','Propuesta','Documentación','Cliente','Cancelado')),
+    coalesce(sum(b.monto_estimado), 0),
+    coalesce(sum(b.monto_real) filter (where b.estatus = 'Cliente'), 0),
+    coalesce(sum(b.monto_estimado) filter (where b.prob_cierre > p_umbral), 0),
+    avg(b.prob_cierre),
+    coalesce(o.detalle, '{}'::jsonb)
+  from base b
+  left join otros o on o.asesor = b.asesor
+  group by b.asesor, o.detalle
+  order by 1;
+$$;
+
+grant execute on function public.resumen_por_asesor(date, date, text, numeric) to authenticated;
+
+-- Alias -> user_id más reciente por asesor (reemplaza escanear miles de capturas en la app).
+create or replace function public.asesores_map()
+returns table (asesor text, user_id uuid)
+language sql
+stable
+security invoker
+as $$
+  select distinct on (c.asesor) c.asesor, c.user_id
+  from public.capturas c
+  where coalesce(c.asesor, '') <> '' and c.user_id is not null
+  order by c.asesor, c.ts desc;
+$$;
+
+grant execute on function public.asesores_map() to authenticated;
+
+-- Suma de metas de un asesor en un rango de periodos (un escalar en vez de filas).
+create or replace function public.meta_asesor_sum(
+  p_uid  uuid,
+  p_from date default null,
+  p_to   date default null
+)
+returns numeric
+language sql
+stable
+security invoker
+as $$
+  select coalesce(sum(m.meta_mxn), 0)
+  from public.metas_asesor m
+  where m.asesor_user_id = p_uid
+    and (p_from is null or m.periodo >= p_from)
+    and (p_to   is null or m.periodo <  p_to);
+$$;
+
+grant execute on function public.meta_asesor_sum(uuid, date, date) to authenticated;
+
+-- Guardado del editor "Mis registros" en un solo round trip.
+-- p_rows: [{"id": "...", "estatus": ..., "monto_real": ..., "nota": ..., "prob_cierre": ...}, ...]
+-- Solo se escriben las llaves presentes en cada elemento (las columnas no editadas no se tocan).
+-- security invoker + filtro por auth.uid(): cada asesor solo actualiza lo suyo.
+create or replace function public.capturas_update_many(p_rows jsonb)
+returns integer
+language plpgsql
+security invoker
+as $$
+declare
+  n integer;
+begin
+  update public.capturas c set
+    estatus     = case when r.v ? 'estatus'     then r.v->>'estatus'                  else c.estatus     end,
+    monto_real  = case when r.v ? 'monto_real'  then (r.v->>'monto_real')::numeric    else c.monto_real  end,
+    nota        = case when r.v ? 'nota'        then r.v->>'nota'                     else c.nota        end,
+    prob_cierre = case when r.v ? 'prob_cierre' then (r.v->>'prob_cierre')::numeric   else c.prob_cierre end
+  from jsonb_array_elements(p_rows) as r(v)
+  where c.id = (r.v->>'id')::uuid
+    and c.user_id = auth.uid();
+  get diagnostics n = row_count;
+  return n;
+end;
+$$;
+
+grant execute on function public.capturas_update_many(jsonb) to authenticated;